@@ -0,0 +1,166 @@
+import copy
+import csv
+import io
+import operator
+
+from sqlalchemy import DateTime, Integer
+
+from DataBasesParser import LogParser, Metrics
+
+
+class RowConverter:
+    # Выбор и преобразование колонок пачки: indexes - позиции в LogParser.FIELDS,
+    # converters - функция для каждой позиции (None - оставить строку). Вычисляется один раз,
+    # а пачка преобразуется по колонкам через map, без обращения к типам колонок на каждое поле
+    def __init__(self, indexes, converters):
+        self.getters = tuple(operator.itemgetter(index) for index in indexes)
+        self.converters = tuple(converters)
+
+    def __call__(self, batch):
+        # -> (преобразованные строки, кортежи разбора этих строк без отброшенных)
+        try:
+            columns = [map(getter, batch) if convert is None else list(map(convert, map(getter, batch)))
+                       for getter, convert in zip(self.getters, self.converters)]
+            return list(zip(*columns)), batch
+        except Exception:
+            # В пачке есть непреобразуемое значение: повторяем построчно и пропускаем только плохие строки
+            return self.convert_rows(batch)
+
+    def convert_rows(self, batch):
+        rows = []
+        kept = []
+        errors = 0
+        sample = None
+        for data in batch:
+            try:
+                rows.append(tuple(getter(data) if convert is None else convert(getter(data))
+                                  for getter, convert in zip(self.getters, self.converters)))
+                kept.append(data)
+            except Exception as e:
+                errors += 1
+                sample = sample or e
+        Metrics.conversion_errors(errors, sample)
+        return rows, kept
+
+
+class BulkLoader:
+    def __init__(self, import_table):
+        self.import_table = import_table
+        # id заполняет СУБД; timestamp в составном ключе секционированной таблицы загружается как обычно
+        self.columns = [column for column in import_table.columns
+                        if not (column.primary_key and isinstance(column.type, Integer))]
+        self.column_names = [column.name for column in self.columns]
+        # Колонка берёт значение поля разбора info['field'] (по умолчанию одноимённого): вычисляемые
+        # колонки преобразуют его функцией info['derive'], в ключ измерения id подставляет DimensionEncoder
+        fields = [column.info.get('field', column.name) for column in self.columns]
+        # Преобразователи типов вычисляются один раз, а не для каждого поля каждой строки
+        self.converters = tuple(self.get_converter(column) for column in self.columns)
+        self.convert = RowConverter([LogParser.FIELD_INDEX[name] for name in fields], self.converters)
+
+    def get_converter(self, column):
+        # None - строка из разбора пишется как есть
+        if 'derive' in column.info:
+            return column.info['derive']
+        if 'dimension' in column.info:
+            return None
+        if isinstance(column.type, Integer):
+            return int
+        if isinstance(column.type, DateTime):
+            return LogParser.parse_timestamp
+        return None
+
+    def to_rows(self, batch):
+        # Кортежи разбора -> кортежи в порядке колонок таблицы с типами колонок
+        return self.convert(batch)[0]
+
+    def to_rows_with_source(self, batch):
+        # То же и кортежи разбора записываемых строк: строки с ошибкой преобразования отброшены
+        return self.convert(batch)
+
+    def prepare(self, connection):
+        self.prepare_statement(connection)
+
+    def prepare_statement(self, connection):
+        pass
+
+    def for_table(self, table, connection):
+        # Загрузчик для таблицы той же схемы (шарда) на уже подготовленном соединении
+        loader = copy.copy(self)
+        loader.import_table = table
+        loader.prepare_statement(connection)
+        return loader
+
+    def load(self, connection, rows):
+        connection.execute(self.import_table.insert(), [dict(zip(self.column_names, row)) for row in rows])
+
+    def _insert_sql(self, connection, placeholder):
+        preparer = connection.dialect.identifier_preparer
+        columns = ', '.join(preparer.quote(name) for name in self.column_names)
+        placeholders = ', '.join([placeholder] * len(self.column_names))
+        return f"INSERT INTO {preparer.format_table(self.import_table)} ({columns}) VALUES ({placeholders})"
+
+
+class SQLiteBulkLoader(BulkLoader):
+    PRAGMAS = (
+        "PRAGMA synchronous = OFF",
+        "PRAGMA journal_mode = MEMORY",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -65536",
+    )
+
+    def get_converter(self, column):
+        # Raw executemany идёт мимо типов SQLAlchemy, поэтому дату пишем в её формате хранения
+        if isinstance(column.type, DateTime):
+            return lambda value: LogParser.parse_timestamp(value).strftime('%Y-%m-%d %H:%M:%S.%f')
+        return super().get_converter(column)
+
+    def prepare(self, connection):
+        for pragma in self.PRAGMAS:
+            connection.exec_driver_sql(pragma)
+        self.prepare_statement(connection)
+
+    def prepare_statement(self, connection):
+        self.sql = self._insert_sql(connection, '?')
+
+    def load(self, connection, rows):
+        # executemany внутри одной транзакции, коммит делает вызывающий код
+        connection.exec_driver_sql(self.sql, rows)
+
+
+class MySQLBulkLoader(BulkLoader):
+    # pymysql переписывает executemany для INSERT ... VALUES в многострочные INSERT,
+    # поэтому LOAD DATA LOCAL INFILE (требует local_infile на клиенте и сервере) не нужен
+    def prepare_statement(self, connection):
+        self.sql = self._insert_sql(connection, '%s')
+
+    def load(self, connection, rows):
+        connection.exec_driver_sql(self.sql, rows)
+
+
+class PostgresBulkLoader(BulkLoader):
+    def prepare_statement(self, connection):
+        preparer = connection.dialect.identifier_preparer
+        columns = ', '.join(preparer.quote(name) for name in self.column_names)
+        self.sql = f"COPY {preparer.format_table(self.import_table)} ({columns}) FROM STDIN WITH (FORMAT csv)"
+
+    def load(self, connection, rows):
+        buffer = io.StringIO()
+        # QUOTE_ALL, чтобы пустые строки не превращались в NULL
+        csv.writer(buffer, quoting=csv.QUOTE_ALL).writerows(rows)
+        buffer.seek(0)
+        cursor = connection.connection.driver_connection.cursor()
+        try:
+            cursor.copy_expert(self.sql, buffer)
+        finally:
+            cursor.close()
+
+
+BULK_LOADERS = {
+    'sqlite': SQLiteBulkLoader,
+    'mysql': MySQLBulkLoader,
+    'postgresql': PostgresBulkLoader,
+}
+
+
+def get_bulk_loader(db_type, import_table):
+    return BULK_LOADERS.get(db_type, BulkLoader)(import_table)
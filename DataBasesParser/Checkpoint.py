@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+
+from DataBasesParser import LogFiles
+
+# Чекпоинты набора ротируемых файлов (access_log, access_log.1, access_log.2.gz, ...) хранятся в одном
+# индексе <база>.checkpoints. Ключ записи - (st_dev, st_ino), а не путь: logrotate переименовывает файлы,
+# и переименованный файл узнаётся по inode. Запись хранит хеш начала содержимого: он отличает
+# переиспользованный inode и находит сжатую копию прежнего живого лога, у которой inode новый
+HEAD_SIZE = 4096
+# Позиция сжатого файла, прочитанного до конца: он больше не меняется
+COMPLETE = 'complete'
+
+
+def index_path(log_file):
+    return f"{LogFiles.rotation_base(log_file)}.checkpoints"
+
+
+def file_key(log_file):
+    stat = os.stat(log_file)
+    return f"{stat.st_dev}:{stat.st_ino}"
+
+
+def head_hash(log_file, size):
+    # Хеш первых size байт содержимого (для сжатого файла - распакованного)
+    with LogFiles.open_log(log_file) as file:
+        head = file.read(size)
+    return len(head), hashlib.blake2b(head, digest_size=16).hexdigest()
+
+
+class CheckpointIndex:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)['files']
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def resume_offsets(self, log_files):
+        # Для каждого файла: None - индекса ещё нет (первый импорт), 0 - новый, обрезанный или
+        # неузнанный файл, COMPLETE - сжатый файл уже прочитан, иначе позиция продолжения
+        entries = self.load()
+        if not entries:
+            return [None] * len(log_files)
+        heads = {}
+
+        def matches(log_file, entry):
+            size = entry['head_size']
+            if (log_file, size) not in heads:
+                heads[log_file, size] = head_hash(log_file, size)
+            return heads[log_file, size] == (size, entry['head'])
+
+        keys = [file_key(log_file) for log_file in log_files]
+        starts = [None] * len(log_files)
+        unused = dict(entries)
+        # Сначала файлы, сохранившие inode (в том числе переименованные ротацией)
+        for position, (log_file, key) in enumerate(zip(log_files, keys)):
+            entry = unused.get(key)
+            if entry is not None and matches(log_file, entry):
+                starts[position] = self._start(log_file, unused.pop(key))
+        # Затем новые inode: сжатая копия прежнего живого лога или копия после copytruncate
+        for position, log_file in enumerate(log_files):
+            if starts[position] is not None:
+                continue
+            key = next((key for key, entry in unused.items() if matches(log_file, entry)), None)
+            starts[position] = 0 if key is None else self._start(log_file, unused.pop(key))
+        return starts
+
+    @staticmethod
+    def _start(log_file, entry):
+        if entry.get('complete'):
+            return COMPLETE if LogFiles.is_compressed(log_file) else 0
+        if not LogFiles.is_compressed(log_file) and os.path.getsize(log_file) < entry['offset']:
+            # Лог обрезан
+            return 0
+        return entry['offset']
+
+    def save(self, log_files, ends):
+        # ends - позиции после импорта (None - сжатый файл прочитан до конца). Записи файлов, которых
+        # нет в этом наборе, остаются, пока файл на месте; записи удалённых файлов отбрасываются
+        entries = {key: entry for key, entry in self.load().items()
+                   if os.path.exists(entry['path']) and file_key(entry['path']) == key}
+        for log_file, end in zip(log_files, ends):
+            head_size, head = head_hash(log_file, HEAD_SIZE if end is None else min(HEAD_SIZE, end))
+            entry = {'path': log_file, 'head_size': head_size, 'head': head}
+            if end is None:
+                entry['complete'] = True
+            else:
+                entry['offset'] = end
+            entries[file_key(log_file)] = entry
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'files': entries}, file)
+        os.replace(temp_path, self.path)
+
+
+def _by_index(log_files):
+    groups = {}
+    for position, log_file in enumerate(log_files):
+        groups.setdefault(index_path(log_file), []).append(position)
+    return groups
+
+
+def resume_offsets(log_files):
+    starts = [None] * len(log_files)
+    for path, positions in _by_index(log_files).items():
+        offsets = CheckpointIndex(path).resume_offsets([log_files[position] for position in positions])
+        for position, start in zip(positions, offsets):
+            starts[position] = start
+    return starts
+
+
+def save(log_files, ends):
+    for path, positions in _by_index(log_files).items():
+        CheckpointIndex(path).save([log_files[position] for position in positions],
+                                   [ends[position] for position in positions])
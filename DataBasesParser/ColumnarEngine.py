@@ -0,0 +1,227 @@
+from array import array
+from datetime import datetime, timezone
+from functools import lru_cache
+import time
+
+import numpy as np
+
+from DataBasesParser import LogParser, Metrics, Rollup
+
+STRING_COLUMNS = ('ip_address', 'forwarded_for', 'request', 'referer', 'user_agent', 'balancer_worker_name')
+NUMERIC_COLUMNS = {'timestamp': 'q', 'status_code': 'i', 'response_size': 'q', 'time_taken': 'q'}
+DTYPES = {'q': np.int64, 'i': np.int32}
+
+
+@lru_cache(maxsize=4096)
+def format_timestamp(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%d/%b/%Y:%H:%M:%S +0000')
+
+
+class StringColumn:
+    # Словарное кодирование: каждая уникальная строка хранится один раз, строки - int32 коды
+    def __init__(self):
+        self.values = []
+        self.index = {}
+        self.codes = array('i')
+
+    def append(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        self.codes.append(code)
+
+    def decode(self, codes):
+        values = self.values
+        return [values[code] for code in codes]
+
+
+class ColumnarStore:
+    def __init__(self):
+        self.strings = {name: StringColumn() for name in STRING_COLUMNS}
+        self.numbers = {name: array(typecode) for name, typecode in NUMERIC_COLUMNS.items()}
+        self._arrays = None
+        self._buffer = None
+
+    @classmethod
+    def from_arrays(cls, numbers, codes, dictionaries, buffer=None):
+        # Хранилище поверх готовых (например, отображённых из кеша) массивов без копирования
+        store = cls()
+        store.numbers = None
+        for name, values in dictionaries.items():
+            column = store.strings[name]
+            column.values = values
+            column.index = {value: code for code, value in enumerate(values)}
+            column.codes = None
+        store._arrays = dict(numbers, **codes)
+        store._buffer = buffer
+        return store
+
+    def __len__(self):
+        if self.numbers is None:
+            return len(self._arrays['timestamp'])
+        return len(self.numbers['timestamp'])
+
+    def _thaw(self):
+        # Перед дозаписью переносим отображённые массивы в изменяемые array
+        self.numbers = {name: array(typecode, self._arrays[name].tobytes()) for name, typecode in NUMERIC_COLUMNS.items()}
+        for name, column in self.strings.items():
+            column.codes = array('i', self._arrays[name].tobytes())
+        self._buffer = None
+
+    def append_batch(self, batch):
+        if self.numbers is None:
+            self._thaw()
+        # NumPy-представления ссылаются на буферы array, их нужно отпустить до дозаписи
+        self._arrays = None
+        strings = [(LogParser.FIELD_INDEX[name], self.strings[name]) for name in STRING_COLUMNS]
+        timestamps = self.numbers['timestamp']
+        status_codes = self.numbers['status_code']
+        response_sizes = self.numbers['response_size']
+        time_taken = self.numbers['time_taken']
+        row_count = 0
+        errors = 0
+        sample = None
+        for data in batch:
+            try:
+                values = (LogParser.parse_epoch(data[LogParser.TIMESTAMP]), int(data[LogParser.STATUS_CODE]),
+                          int(data[LogParser.RESPONSE_SIZE]), int(data[LogParser.TIME_TAKEN]))
+            except ValueError as e:
+                errors += 1
+                sample = sample or e
+                continue
+            timestamps.append(values[0])
+            status_codes.append(values[1])
+            response_sizes.append(values[2])
+            time_taken.append(values[3])
+            for index, column in strings:
+                column.append(data[index])
+            row_count += 1
+        Metrics.conversion_errors(errors, sample)
+        return row_count
+
+    def column(self, name):
+        # NumPy-представления без копирования поверх буферов array
+        if self._arrays is None:
+            arrays = {name: np.frombuffer(values, dtype=DTYPES[values.typecode]) for name, values in self.numbers.items()}
+            arrays.update({name: np.frombuffer(column.codes, dtype=np.int32) for name, column in self.strings.items()})
+            self._arrays = arrays
+        return self._arrays[name]
+
+    def iter_batches(self, batch_size=1000):
+        # Строки в том же виде, что выдаёт LogParser, чтобы писатели СУБД не разбирали лог заново
+        for start in range(0, len(self), batch_size):
+            stop = start + batch_size
+            columns = {name: column.decode(self.column(name)[start:stop]) for name, column in self.strings.items()}
+            columns['timestamp'] = [format_timestamp(value) for value in self.column('timestamp')[start:stop].tolist()]
+            for name in ('status_code', 'response_size', 'time_taken'):
+                columns[name] = [str(value) for value in self.column(name)[start:stop].tolist()]
+            yield list(zip(*(columns[name] for name in LogParser.FIELDS)))
+
+    def since(self, seconds):
+        return int(time.time()) - seconds
+
+    def _mask_since(self, seconds, mask=None):
+        window = self.column('timestamp') >= self.since(seconds)
+        return window if mask is None else mask & window
+
+    def _group(self, columns, mask=None):
+        # Векторный GROUP BY: коды колонок последовательно сворачиваются в один
+        # плотный ключ через np.unique, поэтому произведение кардинальностей не переполняется
+        rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        key = np.zeros(len(rows), dtype=np.int64)
+        for name in columns:
+            codes = self.column(name)[rows].astype(np.int64)
+            key = key * (int(codes.max(initial=0)) + 1) + codes
+            _, key = np.unique(key, return_inverse=True)
+        groups, first, counts = np.unique(key, return_index=True, return_counts=True)
+        return rows[first], counts
+
+    def _top(self, representatives, counts, limit=None):
+        order = np.argsort(-counts, kind='stable')
+        if limit is not None:
+            order = order[:limit]
+        return representatives[order], counts[order]
+
+    def _decode_rows(self, rows, columns, *extra):
+        decoded = [self.strings[name].decode(self.column(name)[rows]) for name in columns]
+        extra = [values.tolist() if isinstance(values, np.ndarray) else values for values in extra]
+        return list(zip(*decoded, *extra))
+
+    def get_ip_user_agent_statistics(self, n):
+        rows, counts = self._top(*self._group(Rollup.CLIENT_COLUMNS), limit=n)
+        return self._decode_rows(rows, ('forwarded_for', 'user_agent', 'referer', 'balancer_worker_name'), counts)
+
+    def get_request_frequency(self, dT):
+        rows, counts = self._top(*self._group(Rollup.CLIENT_COLUMNS, self._mask_since(dT * 60)))
+        return self._decode_rows(rows, Rollup.CLIENT_COLUMNS, counts)
+
+    def get_top_user_agents(self, N):
+        rows, counts = self._top(*self._group(Rollup.CLIENT_COLUMNS), limit=N)
+        return self._decode_rows(rows, Rollup.CLIENT_COLUMNS, counts)
+
+    def get_50x_errors(self, S, dT):
+        status_codes = self.column('status_code')
+        mask = self._mask_since(dT * 60, (status_codes >= 500) & (status_codes <= 599))
+        rows, _ = self._group(Rollup.CLIENT_COLUMNS, mask)
+        return self._decode_rows(rows, Rollup.CLIENT_COLUMNS)
+
+    def get_longest_or_shortest_queries(self, N, longest=True):
+        time_taken = self.column('time_taken')
+        order = np.argsort(-time_taken if longest else time_taken, kind='stable')[:N]
+        return self._decode_rows(order, Rollup.CLIENT_COLUMNS)
+
+    def get_top_requests_to_kth_slash(self, N, K, segment='merlin-service-search'):
+        # Сегмент вычисляется один раз на уникальный request, а не на каждую строку
+        requests = self.strings['request'].values
+        matches = np.fromiter((LogParser.request_segment(request, K) == segment for request in requests),
+                              dtype=bool, count=len(requests))
+        mask = matches[self.column('request')] if len(requests) else np.zeros(len(self), dtype=bool)
+        rows, _ = self._top(*self._group(Rollup.CLIENT_COLUMNS, mask), limit=N)
+        return self._decode_rows(rows, Rollup.CLIENT_COLUMNS)
+
+    def get_upstream_requests(self):
+        rows, counts = self._group(Rollup.CLIENT_COLUMNS)
+        return self._decode_rows(rows, Rollup.CLIENT_COLUMNS, counts)
+
+    def get_conversion_statistics(self, sort_by):
+        rows, counts = self._group(Rollup.CLIENT_COLUMNS)
+        result = self._decode_rows(rows, Rollup.CLIENT_COLUMNS)
+        result = [row + (LogParser.referer_domain(row[1]), count) for row, count in zip(result, counts.tolist())]
+        sort_index = {'forwarded_for': 0, 'referer': 1, 'user_agent': 2, 'balancer_worker_name': 3,
+                      'domain': 4, 'transitions': 5}.get(sort_by, 4)
+        return sorted(result, key=lambda row: row[sort_index])
+
+    def get_outgoing_requests(self, seconds):
+        return self._decode_rows(np.flatnonzero(self._mask_since(seconds)), Rollup.CLIENT_COLUMNS)
+
+    def get_largest_request_periods(self, N):
+        # Как и в MySQL-версии, для каждой минуты возвращается первая её строка
+        minutes, first, counts = np.unique(self.column('timestamp') // 60, return_index=True, return_counts=True)
+        rows, _ = self._top(first, counts, limit=N)
+        return self._decode_rows(rows, Rollup.CLIENT_COLUMNS)
+
+    def get_traffic_by_minute(self, dT=None, status_class=None, balancer_worker_name=None, path_prefix=None):
+        mask = np.ones(len(self), dtype=bool)
+        if dT is not None:
+            mask &= self.column('timestamp') >= (self.since(dT * 60) // 60) * 60
+        if status_class is not None:
+            mask &= self.column('status_code') // 100 == status_class
+        if balancer_worker_name is not None:
+            code = self.strings['balancer_worker_name'].index.get(balancer_worker_name, -1)
+            mask &= self.column('balancer_worker_name') == code
+        if path_prefix is not None:
+            requests = self.strings['request'].values
+            prefixes = np.fromiter((Rollup.path_prefix(request) == path_prefix for request in requests),
+                                   dtype=bool, count=len(requests))
+            mask &= prefixes[self.column('request')] if len(requests) else False
+
+        minutes = self.column('timestamp')[mask] // 60
+        time_taken = self.column('time_taken')[mask]
+        groups, inverse, counts = np.unique(minutes, return_inverse=True, return_counts=True)
+        sums = np.zeros(len(groups), dtype=np.int64)
+        np.add.at(sums, inverse, time_taken)
+        maxima = np.zeros(len(groups), dtype=np.int64)
+        np.maximum.at(maxima, inverse, time_taken)
+        return [(LogParser.epoch_to_datetime(minute * 60), count, total, maximum)
+                for minute, count, total, maximum in zip(groups.tolist(), counts.tolist(), sums.tolist(), maxima.tolist())]
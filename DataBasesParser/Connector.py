@@ -1,167 +1,513 @@
-from sqlalchemy import Boolean, create_engine, MetaData, Table, Column, Integer, String, Text, text
+from sqlalchemy import BigInteger, Boolean, create_engine, DateTime, Index, MetaData, Table, Column, Integer, String, Text, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.inspection import inspect
 from sqlalchemy import quoted_name
 from sqlalchemy import insert
 from sqlalchemy import select, func
-from pymongo import MongoClient
-import redis
-import re
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from DataBasesParser import BulkLoader, Checkpoint, Config, Dimensions, LogFiles, LogParser, Metrics, MongoStore, ParallelImport, Partitions, RedisStore, Rollup, Sketches, SqlFunctions
 class DatabaseConnection:
-    def __init__(self, db_type, db_name):
+    def __init__(self, db_type, db_name, pool_size=None, partitioned=False, normalized=False, settings=None):
         self.db_type = db_type
         self.db_name = db_name
-        self.db_params = {
-            'mysql': {
-                'driver': 'mysql+pymysql',
-                'host': 'localhost',
-                'port': 3306,
-                'user': 'root',
-                'password': '12345678'
-            },
-            'postgresql': {
-                'driver': 'postgresql+psycopg2',
-                'host': 'localhost',
-                'port': 5432,
-                'user': 'postgres',
-                'password': 'password'
-            },
-            'sqlite': {
-                'driver': 'sqlite',
-                'database': 'data.db'
-            },
-            'h2': {
-                'driver': 'h2',
-                'url': 'jdbc:h2:mem:test;DB_CLOSE_DELAY=-1'
-            },
-            'mongodb': {
-                'driver': 'mongodb',
-                'host': 'localhost',
-                'port': 27017
-            },
-            'redis': {
-                'driver': 'redis',
-                'host': 'localhost',
-                'port': 6379
-            }
-        }
+        # Адрес, пул и таймауты из файла конфигурации и переменных окружения (см. Config)
+        self.settings = settings if settings is not None else Config.connection_settings(db_type)
+        # Посуточные секции import (PostgreSQL, MySQL) или шарды import_pYYYYMMDD (SQLite), см. Partitions
+        self.partitioned = partitioned
+        self._partitioner = None
+        # forwarded_for, referer и user_agent в таблицах измерений, в import - их id (см. Dimensions)
+        self.normalized = normalized
+        self._dimension_encoder = None
+        # Размер общего пула соединений, если он не задан в настройках (по умолчанию - настройки драйвера)
+        if pool_size and self.settings['pool_size'] is None:
+            self.settings = dict(self.settings, pool_size=pool_size,
+                                 max_overflow=self.settings['max_overflow'] or 0)
+        # Приближённые сводки текущего импорта (см. import_log_data(sketches=True))
+        self.sketches = None
+        # Посекундные счётчики последних строк follow-режима (см. LiveWindow)
+        self.live_window = None
+        # Отметка версии данных import: меняется при каждом изменении строк (см. ResultCache)
+        self.generation = None
 
     def connect(self):
-        db_params = self.db_params[self.db_type]
+        settings = self.settings
+        url = Config.database_url(self.db_type, settings, self.db_name)
 
-        if self.db_type == 'sqlite':
-            connection_string = f"{db_params['driver']}:///{db_params['database']}"
-        elif self.db_type == 'mongodb':
-            client = MongoClient(db_params['host'], db_params['port'])
+        # Драйверы MongoDB и Redis импортируются только для своего типа базы
+        if self.db_type == 'mongodb':
+            from pymongo import MongoClient
+            options = {}
+            if settings['statement_timeout']:
+                options['timeoutMS'] = int(settings['statement_timeout'] * 1000)
+            client = MongoClient(url, maxPoolSize=Config.max_connections(settings, 100), **options)
             self.db = client[self.db_name]
+            self.collection = self.db['import']
+            self.store = MongoStore.MongoStore(self.db)
+            return
+        elif self.db_type == 'redis':
+            import redis
+            # Один пул соединений на импорт и все отчёты
+            self.redis_pool = redis.ConnectionPool.from_url(
+                url, max_connections=Config.max_connections(settings), decode_responses=True,
+                socket_timeout=settings['statement_timeout'],
+                health_check_interval=30 if settings['pool_pre_ping'] else 0)
+            self.store = RedisStore.RedisStore(redis.Redis(connection_pool=self.redis_pool))
+            return
+        elif self.db_type == 'columnar':
+            # numpy нужен только этому движку, поэтому модуль импортируется по требованию
+            from DataBasesParser import ColumnarEngine
+            self.store = ColumnarEngine.ColumnarStore()
             return
-        elif self.db_type == 'h2':
-            connection_string = f"{db_params['driver']}:{db_params['url']}"
-        else:
-            connection_string = f"{db_params['driver']}://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}"
 
-        self.engine = create_engine(connection_string)
+        # Один движок и его пул на импорт и все отчёты; драйвер СУБД загружается здесь
+        self.engine = create_engine(url, **Config.engine_options(self.db_type, settings))
         self.metadata = MetaData()
+        if self.db_type == 'sqlite':
+            SqlFunctions.register_sqlite_functions(self.engine)
+        Metrics.instrument_engine(self.engine)
 
-        if self.db_type in ['mysql', 'postgresql']:
-            # Проверить, существует ли база данных
-            with self.engine.connect() as connection:
-                if self.db_type == 'postgresql':
-                    exists = connection.execute(text(f"SELECT 1 FROM pg_database WHERE datname='{self.db_name}'")).fetchone()
-                else:  # Для MySQL
-                    exists = connection.execute(text(f"SELECT 1 FROM information_schema.schemata WHERE schema_name = '{self.db_name}'")).fetchone()
+        if self.db_type in Config.SERVER_DATABASES:
+            self._create_database()
 
+    def _create_database(self):
+        # Обычно база уже есть и проверка - это первое соединение пула
+        try:
+            with self.engine.connect():
+                return
+        except OperationalError:
+            pass
+        # Иначе база создаётся через временное соединение к серверу (PostgreSQL - к служебной базе postgres);
+        # если не удалось подключиться и к серверу, ошибка уходит вызывающему
+        server = create_engine(self.engine.url.set(database='postgres' if self.db_type == 'postgresql' else None),
+                               poolclass=NullPool, isolation_level='AUTOCOMMIT')
+        try:
+            with server.connect() as connection:
+                if self.db_type == 'postgresql':
+                    exists = connection.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"),
+                                                {'name': self.db_name}).fetchone()
+                else:
+                    exists = connection.execute(text("SELECT 1 FROM information_schema.schemata WHERE schema_name = :name"),
+                                                {'name': self.db_name}).fetchone()
                 if not exists:
-                    # Создать базу данных
-                    connection.execute(text(f"CREATE DATABASE {self.db_name}" if self.db_type == 'postgresql' else f"CREATE DATABASE IF NOT EXISTS {self.db_name}"))
-                    # Повторно подключиться к созданной базе данных
-                    connection.close()
-                    self.engine = create_engine(connection_string)
+                    connection.exec_driver_sql(
+                        f"CREATE DATABASE {connection.dialect.identifier_preparer.quote(self.db_name)}")
+        finally:
+            server.dispose()
+
+    def define_import_table(self):
+        if 'import' in self.metadata.tables:
+            return self.metadata.tables['import']
 
-    def create_import_table(self):
+        # Ключ секционированной таблицы должен включать timestamp
+        native_partitions = self.partitioned and self.db_type in ('postgresql', 'mysql')
+        options = Partitions.PostgresPartitioner.TABLE_OPTIONS if native_partitions and self.db_type == 'postgresql' else {}
         import_table = Table('import', self.metadata,
-                            Column('id', Integer, primary_key=True),
+                            Column('id', Integer, primary_key=True, autoincrement=True),
                             Column('ip_address', Text(length=50), nullable=True),
-                            Column('forwarded_for', Text(length=3000), nullable=True),
-                            Column('timestamp', Text(length=3000), nullable=True),
+                            self._client_column('forwarded_for'),
+                            Column('timestamp', DateTime, primary_key=native_partitions, nullable=not native_partitions),
                             Column('request', Text(length=3000), nullable=True),
+                            *self._request_columns(),
                             Column('status_code', Integer),
                             Column('response_size', Integer),
-                            Column('time_taken', Text(length=50), nullable=True),
-                            Column('referer', Text(length=3000), nullable=True),
-                            Column('user_agent', Text(length=3000), nullable=True),
-                            Column('balancer_worker_name', Text(length=100), nullable=True))
+                            Column('time_taken', BigInteger, nullable=True),
+                            self._client_column('referer'),
+                            self._client_column('user_agent'),
+                            Column('balancer_worker_name', Text(length=100), nullable=True),
+                            Column('referer_domain', Text(length=3000), nullable=True,
+                                   info={'field': 'referer', 'derive': LogParser.referer_domain}),
+                            **options)
+
+        # Индексы под фильтры и группировки методов Analyzer.
+        # Для TEXT-колонок MySQL индексирует только префикс
+        Index('ix_import_timestamp', import_table.c.timestamp)
+        Index('ix_import_status_code_timestamp', import_table.c.status_code, import_table.c.timestamp)
+        Index('ix_import_time_taken', import_table.c.time_taken)
+        # Отчёт по k-му сегменту пути - поиск по индексу колонки сегмента, а не разбор request в каждой строке
+        for k in range(1, LogParser.PATH_SEGMENTS + 1):
+            Index(f"ix_import_path_seg{k}", import_table.c[f"path_seg{k}"], mysql_length=255)
+        Index('ix_import_referer_domain', import_table.c.referer_domain, mysql_length=255)
+        group = [import_table.c[name] for name in self.client_column_names()]
+        Index('ix_import_group', *group,
+              mysql_length={'forwarded_for': 64, 'referer': 255, 'user_agent': 255, 'balancer_worker_name': 64})
+        return import_table
+
+    def _client_column(self, name):
+        if self.normalized:
+            return Column(Dimensions.key_column(name), Integer, nullable=True, info={'field': name, 'dimension': name})
+        return Column(name, Text(length=3000), nullable=True)
+
+    @staticmethod
+    def _request_columns():
+        # Части request, вычисляемые загрузчиком при импорте (см. LogParser.REQUEST_PARTS)
+        lengths = {'method': 16, 'protocol': 16}
+        return [Column(name, Text(length=lengths.get(name, 3000)), nullable=True,
+                       info={'field': 'request', 'derive': LogParser.request_part(name)})
+                for name in LogParser.REQUEST_PARTS]
+
+    def client_column_names(self):
+        # Колонки группы клиента в import: в нормализованной схеме - ключи измерений
+        if self.normalized:
+            return tuple(Dimensions.key_column(name) if name in Dimensions.DIMENSION_COLUMNS else name
+                         for name in Rollup.CLIENT_COLUMNS)
+        return Rollup.CLIENT_COLUMNS
+
+    def dimension_encoder(self):
+        # Один кодировщик на соединение: его LRU переживает пачки и опросы follow-режима
+        if self._dimension_encoder is None:
+            self._dimension_encoder = Dimensions.DimensionEncoder(self.metadata)
+        return self._dimension_encoder
+
+    def define_generation_table(self):
+        if 'import_generation' in self.metadata.tables:
+            return self.metadata.tables['import_generation']
+        return Table('import_generation', self.metadata,
+                     Column('id', Integer, primary_key=True),
+                     Column('stamp', Text(length=32)))
+
+    def identity(self):
+        # Какая именно база отвечает на отчёты; колоночный движок живёт только в памяти процесса
+        if self.db_type == 'sqlite':
+            return self.db_type, os.path.abspath(make_url(self.settings['url']).database)
+        if self.db_type == 'columnar':
+            return self.db_type, os.getpid(), id(self)
+        return self.db_type, Config.display_url(self.settings['url']), self.db_name
+
+    def import_generation(self):
+        # Текущая отметка из базы: её мог сменить импорт в другом процессе
+        if self.db_type in ('mongodb', 'redis'):
+            self.generation = self.store.get_generation()
+        elif self.db_type != 'columnar':
+            generation_table = self.define_generation_table()
+            with self.engine.connect() as connection:
+                if inspect(connection).has_table(generation_table.name):
+                    self.generation = connection.execute(select(generation_table.c.stamp)).scalar()
+                else:
+                    self.generation = None
+        return self.generation
+
+    def _bump_generation(self):
+        stamp = uuid.uuid4().hex
+        if self.db_type in ('mongodb', 'redis'):
+            self.store.set_generation(stamp)
+        elif self.db_type != 'columnar':
+            generation_table = self.define_generation_table()
+            with self.engine.connect() as connection:
+                generation_table.create(connection, checkfirst=True)
+                connection.execute(generation_table.delete())
+                connection.execute(generation_table.insert(), {'id': 1, 'stamp': stamp})
+                connection.commit()
+        self.generation = stamp
+
+    def create_import_table(self, clear=True):
+        import_table = self.define_import_table()
 
         with self.engine.connect() as connection:
-            # Выбор базы данных
-            connection.execute(text(f"USE {self.db_name}"))
             inspector = inspect(connection)
-            import_table_exists = inspector.has_table('import', schema=self.db_name)
+            import_table_exists = inspector.has_table('import')
+            if import_table_exists and (not self._has_typed_schema(inspector)
+                                        or self._has_native_partitions(connection) != self._native_partitions()
+                                        or self._has_normalized_schema(inspector) != self.normalized
+                                        or self.normalized and not Dimensions.has_value_hashes(inspector)):
+                # Таблица от старой версии со строковыми timestamp/time_taken, с другим секционированием,
+                # с другой схемой хранения строк клиента или с ключами измерений без уникального value_hash
+                import_table.drop(connection)
+                import_table_exists = False
             if not import_table_exists:
                 import_table.create(connection)
-            else:
+                if self._native_partitions() and self.db_type == 'mysql':
+                    self.partitioner().partition(connection)
+                connection.commit()
+            elif clear:
                 #Очистите таблицу импорта перед импортом данных
-                connection.execute(import_table.delete())
+                if not self._native_partitions():
+                    connection.execute(import_table.delete())
+                if self.partitioned:
+                    # Секции и шарды не очищаются построчно, а удаляются целиком
+                    self.partitioner().clear(connection)
                 connection.commit()
 
-    def import_log_data(self, log_file):
-        regex = r'^(?P<ip_address>\S+) \((?P<forwarded_for>\S+)\) - - \[(?P<timestamp>[\w:/]+\s[+\-]\d{4})\] "(?P<request>[A-Z]+ \S+ \S+)" (?P<status_code>\d+) (?P<response_size>\d+) (?P<time_taken>\d+) (?P<balancer_worker_name>\d+) "(?P<referer>[^"]*)" "(?P<user_agent>[^"]*)"'
-        pattern = re.compile(regex)
+    def _native_partitions(self):
+        return self.partitioned and self.db_type in ('postgresql', 'mysql')
+
+    def _has_native_partitions(self, connection):
+        if self.db_type == 'postgresql':
+            return connection.execute(text(
+                "SELECT 1 FROM pg_partitioned_table JOIN pg_class ON pg_class.oid = pg_partitioned_table.partrelid "
+                "WHERE pg_class.relname = 'import'")).first() is not None
+        if self.db_type == 'mysql':
+            return connection.execute(text(
+                "SELECT 1 FROM information_schema.partitions WHERE table_schema = DATABASE() "
+                "AND table_name = 'import' AND partition_name IS NOT NULL")).first() is not None
+        return False
+
+    def partitioner(self):
+        if self._partitioner is None:
+            self._partitioner = Partitions.get_partitioner(self.db_type, self.define_import_table())
+        return self._partitioner
+
+    def shard_days(self, since=None, connection=None):
+        # Дни шардов SQLite, пересекающиеся с окном [since, ...); None - таблица не шардирована
+        if not (self.partitioned and self.db_type == 'sqlite'):
+            return None
+        if connection is None:
+            with self.engine.connect() as connection:
+                days = self.partitioner().days(connection)
+        else:
+            days = self.partitioner().days(connection)
+        return tuple(sorted(day for day in days if since is None or day >= since.date()))
+
+    def import_source(self, since=None, connection=None):
+        # Откуда читать строки импорта: таблица import (секции PostgreSQL/MySQL отсекает сама СУБД)
+        # или UNION ALL только нужных шардов SQLite
+        days = self.shard_days(since, connection)
+        if days is None:
+            return self.define_import_table()
+        return Partitions.shard_source(self.define_import_table(), days)
+
+    def apply_retention(self, days):
+        # Удаление строк старше days суток (UTC): DROP секций или шардов, без секционирования - DELETE.
+        # Роллапы приводятся к оставшимся строкам
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).date()
+        import_table = self.define_import_table()
+        with self.engine.connect() as connection:
+            if self.partitioned:
+                dropped = len(self.partitioner().drop_before(connection, cutoff))
+            else:
+                dropped = connection.execute(import_table.delete().where(
+                    import_table.c.timestamp < datetime.combine(cutoff, datetime.min.time()))).rowcount
+            source = self.import_source(connection=connection)
+            if self.normalized:
+                source = Dimensions.decoded(source, self.metadata).subquery('import')
+            Rollup.apply_retention(connection, self.metadata, cutoff, source)
+            connection.commit()
+        if dropped:
+            self._bump_generation()
+        return dropped
+
+    @staticmethod
+    def _has_typed_schema(inspector):
+        # Заодно проверяется, что в таблице есть колонки, вычисляемые из request и referer
+        columns = {column['name']: column['type'] for column in inspector.get_columns('import')}
+        return (isinstance(columns.get('timestamp'), DateTime) and isinstance(columns.get('time_taken'), Integer)
+                and all(name in columns for name in LogParser.REQUEST_PARTS + ('referer_domain',)))
+
+    @staticmethod
+    def _has_normalized_schema(inspector):
+        columns = {column['name'] for column in inspector.get_columns('import')}
+        return all(key in columns for key in Dimensions.KEY_COLUMNS)
+
+    def import_log_data(self, log_files, workers=1, incremental=False, parse_cache=False, sketches=False):
+        # log_files - путь, шаблон glob или их список (ротированные и сжатые логи, см. LogFiles).
+        # Позиция последней полной строки каждого файла сохраняется после импорта в индексе
+        # чекпоинтов набора (см. Checkpoint). В инкрементальном режиме читаются только строки,
+        # дописанные после неё; файлы, переименованные или сжатые ротацией, узнаются и не читаются повторно
+        log_files = LogFiles.expand(log_files)
+        starts = Checkpoint.resume_offsets(log_files) if incremental else [None] * len(log_files)
+        clear = all(start is None for start in starts)
+        ends = [LogFiles.data_end(log_file) for log_file in log_files]
+        single = len(log_files) == 1 and not LogFiles.is_compressed(log_files[0])
+
+        # Сводки копятся попутно с записью и сохраняются рядом с логом (<log>.sketches);
+        # при дописывании новые строки сливаются с уже сохранёнными сводками
+        self.sketches = Sketches.SketchSet() if sketches else None
+        start_time = time.perf_counter()
+        if single and parse_cache and clear:
+            row_count = self._import_cached(log_files[0], ends[0], workers)
+        elif single:
+            row_count = self._import_range(log_files[0], starts[0] or 0, ends[0], workers, clear)
+        else:
+            ranges = [(log_file, start or 0, end) for log_file, start, end in zip(log_files, starts, ends)
+                      if start != Checkpoint.COMPLETE and (end is None or (start or 0) < end)]
+            row_count = self._import_files(ranges, workers, clear)
+        self._record_import(row_count, time.perf_counter() - start_time)
+        if sketches:
+            # Сводки набора файлов хранятся рядом с самым новым из них
+            self._save_sketches(Sketches.sketch_path(log_files[-1]), clear)
+        Checkpoint.save(log_files, ends)
+        if row_count or clear:
+            self._bump_generation()
+        return row_count
+
+    @staticmethod
+    def _record_import(row_count, seconds):
+        Metrics.METRICS.observe('import', seconds)
+        Metrics.METRICS.inc('import_rows', row_count)
+        Metrics.METRICS.set('import_rows_per_second', round(row_count / max(seconds, 1e-9), 1))
+
+    def _save_sketches(self, path, clear):
+        if not clear:
+            previous = Sketches.SketchSet.load(path)
+            if previous is not None:
+                previous.merge(self.sketches)
+                self.sketches = previous
+        self.sketches.save(path)
+
+    def _import_cached(self, log_file, end, workers):
+        # Полный импорт через кеш разбора: при неизменном логе колонки берутся из mmap,
+        # иначе лог разбирается один раз, а колонки попутно сохраняются в кеш
+        from DataBasesParser import ColumnarEngine, ParseCache
+        cache = ParseCache.ParseCache(log_file)
+        store = cache.load()
+        if store is not None:
+            if self.db_type == 'columnar':
+                self.store = store
+                if self.sketches is not None:
+                    for batch in store.iter_batches():
+                        self.sketches.add_batch(batch)
+                return len(store)
+            return self._write_batches(store.iter_batches(), clear=True)
+
+        cache.start_hashing()
+        store = ColumnarEngine.ColumnarStore()
+
+        def collect(batches):
+            for batch in batches:
+                store.append_batch(batch)
+                yield batch
+
+        if self.db_type == 'columnar':
+            self.store = store
+            batches = self._observe(self._parse_range(log_file, 0, end, workers))
+            row_count = sum(store.append_batch(batch) for batch in batches)
+        else:
+            row_count = self._write_batches(collect(self._parse_range(log_file, 0, end, workers)), clear=True)
+        cache.save(store, end)
+        return row_count
+
+    def follow_log_data(self, log_file, interval=1.0, workers=1, window=None, on_poll=None):
+        # Хвост живого лога: каждые interval секунд дописываем новые строки микропакетом.
+        # window (LiveWindow.SlidingWindow) попутно копит посекундные счётчики, on_poll вызывается
+        # после каждого опроса лога, например для печати окон
+        self.sketches = None
+        self.live_window = window
+        while True:
+            start = Checkpoint.resume_offsets([log_file])[0]
+            end = LogFiles.last_line_end(log_file)
+            if start is None or end > start:
+                start_time = time.perf_counter()
+                row_count = self._import_range(log_file, start or 0, end, workers, False)
+                self._record_import(row_count, time.perf_counter() - start_time)
+                Checkpoint.save([log_file], [end])
+                if row_count:
+                    self._bump_generation()
+            if on_poll is not None:
+                on_poll()
+            time.sleep(interval)
+
+    def _parse_range(self, log_file, start, end, workers):
+        if workers > 1:
+            return ParallelImport.parse_file_parallel(log_file, workers, start=start, end=end)
+        return LogParser.parse_file(log_file, start=start, end=end)
+
+    def _import_range(self, log_file, start, end, workers, clear):
+        return self._write_batches(self._parse_range(log_file, start, end, workers), clear)
+
+    def _import_files(self, ranges, workers, clear):
+        # Несколько файлов: при workers > 1 файлы распаковываются и разбираются одновременно
+        if workers > 1:
+            batches = ParallelImport.parse_files_parallel(ranges, workers)
+        else:
+            batches = (batch for log_file, start, end in ranges
+                       for batch in self._parse_range(log_file, start, end, 1))
+        return self._write_batches(batches, clear)
+
+    def _observe(self, batches):
+        if self.sketches is not None:
+            batches = self.sketches.observe(batches)
+        if self.live_window is not None:
+            batches = self.live_window.observe(batches)
+        return batches
+
+    def _write_batches(self, batches, clear):
+        batches = self._observe(batches)
         if self.db_type == 'mongodb':
-            self.collection = self.db['import']
-            with open(log_file, 'r') as file:
-                for line in file:
-                    match = pattern.match(line)
-                    if match:
-                        data = match.groupdict()
-                        self.collection.insert_one(data)
+            return self._write_mongodb(batches, clear)
         elif self.db_type == 'redis':
-            r = redis.Redis(host=self.db_params['redis']['host'], port=self.db_params['redis']['port'])
-            with open(log_file, 'r') as file:
-                for line in file:
-                    match = pattern.match(line)
-                    if match:
-                        data = match.groupdict()
-                        r.hmset('import', data)
+            return self._write_redis(batches, clear)
+        elif self.db_type == 'columnar':
+            return self._write_columnar(batches, clear)
         else:
-            self.create_import_table()
-            with self.engine.connect() as connection:
-                import_table = self.metadata.tables['import']
-                values_batch = []  # List to store batched values
-                batch_size = 1000  # Adjust the batch size as needed
-
-                with open(log_file, 'r') as file:
-                    for line in file:
-                        match = pattern.match(line)
-                        if match:
-                            data = match.groupdict()
-                            try:
-                                values = {}
-                                for column, value in data.items():
-                                    if column in import_table.columns:
-                                        column_obj = import_table.columns[column]
-                                        if isinstance(column_obj.type, Integer):
-                                            value = int(value)
-                                        elif isinstance(column_obj.type, String):
-                                            value = str(value)
-                                        values[column_obj] = value
-
-                                values_batch.append(values)  # Add values to the batch
-
-                                if len(values_batch) >= batch_size:
-                                    # Perform batch insert
-                                    connection.execute(import_table.insert().values(values_batch))
-                                    values_batch = []  # Clear the batch
-
-                            except Exception as e:
-                                print(f"An error occurred: {e}")
-
-                    # Insert remaining values in the batch
-                    if values_batch:
-                        connection.execute(import_table.insert().values(values_batch))
-
-                    connection.commit()
+            return self._write_sql(batches, clear)
+
+    def _write_mongodb(self, batches, clear=True):
+        if clear:
+            self.store.clear()
+        else:
+            self.store.create_indexes()
+        return self._write_store_batches(batches)
+
+    def _write_store_batches(self, batches):
+        row_count = 0
+        for batch in batches:
+            with Metrics.METRICS.timer('import_batch_flush'):
+                row_count += self.store.write_batch(batch)
+        return row_count
+
+    def _write_redis(self, batches, clear=True):
+        if clear:
+            self.store.clear()
+        return self._write_store_batches(batches)
+
+    def _write_columnar(self, batches, clear=True):
+        if clear:
+            self.store = type(self.store)()
+        row_count = 0
+        for batch in batches:
+            with Metrics.METRICS.timer('import_batch_flush'):
+                row_count += self.store.append_batch(batch)
+        return row_count
+
+    def _write_sql(self, batches, clear=True):
+        self.create_import_table(clear)
+        import_table = self.metadata.tables['import']
+        loader = BulkLoader.get_bulk_loader(self.db_type, import_table)
+        partitioner = self.partitioner() if self.partitioned else None
+        if partitioner is not None:
+            # Секции могли измениться после прошлого импорта (другой процесс, удаление вручную)
+            partitioner.refresh()
+        encoder = self.dimension_encoder() if self.normalized else None
+        rollup = Rollup.RollupAccumulator(self.metadata)
+        row_count = 0
+        with self.engine.connect() as connection:
+            loader.prepare(connection)
+            # Роллапы и измерения обновляются в той же транзакции, что и сырые строки
+            rollup.create(connection, clear)
+            if encoder is not None:
+                encoder.create(connection, clear)
+            for batch in batches:
+                with Metrics.METRICS.timer('import_convert'):
+                    rows, written = loader.to_rows_with_source(batch)
+                if encoder is not None:
+                    with Metrics.METRICS.timer('import_dimensions'):
+                        rows = encoder.encode_rows(connection, rows, loader.column_names)
+                if rows:
+                    with Metrics.METRICS.timer('import_batch_flush'):
+                        if partitioner is not None:
+                            partitioner.load(connection, loader, rows)
+                        else:
+                            loader.load(connection, rows)
+                    with Metrics.METRICS.timer('import_rollup'):
+                        rollup.add(written)
+                        rollup.flush_if_full(connection)
+                    row_count += len(rows)
+
+            with Metrics.METRICS.timer('import_commit'):
+                rollup.flush(connection)
+                connection.commit()
+        return row_count
+
     def close(self):
         if self.db_type == 'mongodb':
             self.db.client.close()
+        elif self.db_type == 'redis':
+            self.redis_pool.disconnect()
+        elif self.db_type == 'columnar':
+            self.store = None
         else:
             self.engine.dispose()
\ No newline at end of file
@@ -1,231 +1,429 @@
-from sqlalchemy import Text, text
-import redis
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import BigInteger, DateTime, Integer, bindparam, cast, func, select
+from DataBasesParser import Dimensions, FusedScan, LatencyHistogram, LiveWindow, LogFiles, LogParser, Metrics, ParallelImport, Rollup, Sketches, SqlFunctions
 import time
 import logging
+# Бэкенды, у которых отчёты реализованы в самом хранилище (db_connection.store)
+STORE_BACKENDS = ('columnar', 'redis', 'mongodb')
+# Отчёты без LIMIT, которые MongoDB и Redis в потоковом режиме читают частями по partition_size
+STREAMED_STORE_REPORTS = ('get_request_frequency', 'get_50x_errors', 'get_upstream_requests',
+                          'get_conversion_statistics', 'get_outgoing_requests')
+
+
 class Analyzer:
-    def __init__(self, db_connection, db_type):
+    def __init__(self, db_connection, db_type, stream=False, partition_size=1000, use_rollups=True,
+                 approximate=False, sketch_paths=()):
         self.db_connection = db_connection
         self.db_type = db_type
+        # В потоковом режиме методы возвращают генератор строк вместо списка
+        self.stream = stream
+        self.partition_size = partition_size
+        self.use_rollups = use_rollups
+        self._rollups_available = None
+        # Построенные выражения отчётов: значения передаются связанными параметрами,
+        # поэтому SQLAlchemy переиспользует скомпилированный запрос, а драйвер - план
+        self._statements = {}
+        # Приближённый режим: top-K групп считается по сохранённым при импорте сводкам
+        # (файлы sketch_paths сливаются), в ограниченной памяти и без GROUP BY по сырой таблице
+        self.approximate = approximate
+        self.sketch_paths = sketch_paths
+        self._sketches = None
         
     @staticmethod
     def log_execution_time(func):
         def wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_time = time.perf_counter()
             result = func(*args, **kwargs)
-            execution_time = time.time() - start_time
+            execution_time = time.perf_counter() - start_time
+            Metrics.METRICS.observe(f"method_{func.__name__}", execution_time)
             logger = logging.getLogger(__name__)
-            logger.info(f"Method {func.__name__} executed in {execution_time:.2f} seconds")
+            logger.info(f"Method {func.__name__} executed in {execution_time * 1000:.3f} ms")
             return result
         return wrapper
     
+    @staticmethod
+    def since(**delta):
+        # timestamp хранится в UTC, граница окна считается на стороне клиента,
+        # чтобы запрос был диапазоном по индексу, а не сравнением с NOW()
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        return now - timedelta(**delta)
+
+    def statement(self, key, build, since=None):
+        # При шардах SQLite выражение зависит ещё и от набора шардов окна
+        key = (key, self.db_connection.shard_days(since))
+        query = self._statements.get(key)
+        if query is None:
+            query = self._statements[key] = build()
+        return query
+
+    def sketches(self):
+        if self._sketches is None:
+            self._sketches = Sketches.SketchSet.load_merged(self.sketch_paths)
+            if self._sketches is None:
+                raise ValueError("No sketches found, import the log with sketches enabled first")
+        return self._sketches
+
+    def import_table(self, since=None):
+        # since - начало окна отчёта: при посуточном секционировании читаются только его секции
+        return self.db_connection.import_source(since)
+
+    def client_columns(self, table, names=Rollup.CLIENT_COLUMNS):
+        # В нормализованной схеме import группируется по целочисленным ключам измерений
+        return [table.c[Dimensions.key_column(name)] if Dimensions.key_column(name) in table.c else table.c[name]
+                for name in names]
+
+    def with_labels(self, query, order_by=(), hidden=()):
+        # Итоговые строки отчёта: колонки hidden нужны только для сортировки и в результат не входят.
+        # В нормализованной схеме строки измерений присоединяются к уже сгруппированным и обрезанным
+        # LIMIT строкам, а порядок задаёт order_by - пары (колонка, по убыванию)
+        if not self.db_connection.normalized:
+            if not hidden:
+                return query
+            return query.with_only_columns(*(column for column in query.selected_columns if column.name not in hidden),
+                                           maintain_column_froms=True)
+        rows = query.subquery('result')
+        labeled = Dimensions.decoded(rows, self.db_connection.metadata)
+        # Сортировка по колонке измерения идёт по её строке, остальные колонки берутся из rows
+        columns = {column.name: column for column in labeled.selected_columns}
+        labeled = labeled.with_only_columns(*(column for column in labeled.selected_columns if column.name not in hidden),
+                                            maintain_column_froms=True)
+        order = [columns[name] if name in Dimensions.DIMENSION_COLUMNS else rows.c[name] for name, _ in order_by]
+        return labeled.order_by(*(column.desc() if descending else column
+                                  for column, (_, descending) in zip(order, order_by)))
+
+    def rollups_available(self):
+        if not self.use_rollups or self.db_type in ('mongodb', 'redis'):
+            return False
+        if self._rollups_available is None:
+            with self.db_connection.engine.connect() as connection:
+                self._rollups_available = Rollup.has_rollup_tables(connection)
+        return self._rollups_available
+
+    def _client_rollup_query(self, columns, label, limit=False):
+        # Суммы предагрегированных дельт вместо COUNT(*) по сырой таблице
+        _, client_table = Rollup.define_rollup_tables(self.db_connection.metadata)
+        group = self.client_columns(client_table, columns)
+        total = cast(func.sum(client_table.c.request_count), BigInteger).label(label)
+        query = select(*group, total).group_by(*group)
+        if limit:
+            query = query.order_by(total.desc()).limit(bindparam('limit', type_=Integer))
+        return query
+
+    def store_report(self, name, *args, **kwargs):
+        # Отчёт хранилища; в потоковом режиме, как и для SQL, возвращается итератор строк
+        method = getattr(self.db_connection.store, name)
+        if not self.stream:
+            return method(*args, **kwargs)
+        if name in STREAMED_STORE_REPORTS and self.db_type in ('mongodb', 'redis'):
+            return method(*args, partition_size=self.partition_size, **kwargs)
+        return iter(method(*args, **kwargs))
+
     @log_execution_time
-    def execute_query(self, query):
+    def execute_query(self, query, params=None):
+        if self.stream:
+            return self.stream_query(query, params)
         if self.db_type == 'mongodb':
             return self.db_connection.collection.find(query)
         elif self.db_type == 'redis':
-            r = redis.Redis(host=self.db_connection.db_params['redis']['host'], port=self.db_connection.db_params['redis']['port'])
-            return r.hgetall('import')
+            return [row for partition in self.db_connection.store.iter_row_partitions() for row in partition]
+        else:
+            with self.db_connection.engine.connect() as connection:
+                result = connection.execute(query, params or {})
+                with Metrics.METRICS.timer('query_fetch'):
+                    return result.fetchall()
+
+    def stream_partitions(self, query, params=None):
+        # Строки читаются частями по partition_size: серверный курсор для SQL,
+        # пакеты курсора для MongoDB и конвейерные HMGET по id строк для Redis
+        if self.db_type == 'mongodb':
+            partition = []
+            for document in self.db_connection.collection.find(query).batch_size(self.partition_size):
+                partition.append(document)
+                if len(partition) >= self.partition_size:
+                    yield partition
+                    partition = []
+            if partition:
+                yield partition
+        elif self.db_type == 'redis':
+            yield from self.db_connection.store.iter_row_partitions(self.partition_size)
         else:
+            # Без серверных курсоров (настройка server_side_cursors) драйвер буферизует результат,
+            # а части по partition_size нарезаются из буфера
+            server_side = self.db_connection.settings['server_side_cursors']
+            options = {'stream_results': True, 'yield_per': self.partition_size} if server_side else {}
             with self.db_connection.engine.connect() as connection:
-                result = connection.execute(query)
-                return result.fetchall()
+                result = connection.execution_options(**options).execute(query, params or {})
+                partitions = result.partitions(None if server_side else self.partition_size)
+                while True:
+                    with Metrics.METRICS.timer('query_fetch'):
+                        partition = next(partitions, None)
+                    if partition is None:
+                        break
+                    yield partition
+
+    def stream_query(self, query, params=None):
+        for partition in self.stream_partitions(query, params):
+            yield from partition
             
     @log_execution_time        
     def get_ip_user_agent_statistics(self, n): 
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        user_agent = import_table.c.user_agent
-        referer = import_table.c.referer
-        balancer_worker_name = import_table.c.balancer_worker_name
-        
-        query = text(f"SELECT {forwarded_for}, {user_agent}, {referer}, {balancer_worker_name}, COUNT(*) AS count "
-                 "FROM import "
-                 "GROUP BY forwarded_for, user_agent, referer, balancer_worker_name "
-                 "ORDER BY count DESC "
-                 f"LIMIT {n}")
+        if self.approximate:
+            return [(forwarded_for, user_agent, referer, worker, count)
+                    for (forwarded_for, referer, user_agent, worker), count in self.sketches().top_clients(n)]
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_ip_user_agent_statistics', n)
+        columns = ('forwarded_for', 'user_agent', 'referer', 'balancer_worker_name')
+        if self.rollups_available():
+            query = self.statement('ip_user_agent_statistics_rollup',
+                                   lambda: self._client_rollup_query(columns, 'count', limit=True))
+            return self.execute_query(query, {'limit': n})
+
+        def build():
+            import_table = self.import_table()
+            group = self.client_columns(import_table, columns)
+            count = func.count().label('count')
+            return self.with_labels(select(*group, count).group_by(*group)
+                                    .order_by(count.desc()).limit(bindparam('limit', type_=Integer)),
+                                    order_by=(('count', True),))
 
-        return self.execute_query(query)
+        return self.execute_query(self.statement('ip_user_agent_statistics', build), {'limit': n})
     
     def get_request_frequency(self, dT): 
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name}, COUNT(*) AS frequency "
-                    "FROM import "
-                    "WHERE timestamp >= NOW() - INTERVAL :interval MINUTE "
-                    "GROUP BY forwarded_for, referer, user_agent, balancer_worker_name "
-                    "ORDER BY frequency DESC")
-
-        return self.execute_query(query.bindparams(interval=dT))
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_request_frequency', dT)
+        since = self.since(minutes=dT)
+
+        def build():
+            import_table = self.import_table(since)
+            group = self.client_columns(import_table)
+            frequency = func.count().label('frequency')
+            return self.with_labels(select(*group, frequency)
+                                    .where(import_table.c.timestamp >= bindparam('since', type_=DateTime))
+                                    .group_by(*group).order_by(frequency.desc()),
+                                    order_by=(('frequency', True),))
+
+        return self.execute_query(self.statement('request_frequency', build, since), {'since': since})
     
     def get_top_user_agents(self, N):
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name}, COUNT(*) AS frequency "
-                    "FROM import "
-                    "GROUP BY forwarded_for, referer, user_agent, balancer_worker_name "
-                    "ORDER BY frequency DESC "
-                    f"LIMIT {N}")
-
-        return self.execute_query(query)
+        if self.approximate:
+            return [group + (count,) for group, count in self.sketches().top_clients(N)]
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_top_user_agents', N)
+        if self.rollups_available():
+            query = self.statement('top_user_agents_rollup',
+                                   lambda: self._client_rollup_query(Rollup.CLIENT_COLUMNS, 'frequency', limit=True))
+            return self.execute_query(query, {'limit': N})
+
+        def build():
+            import_table = self.import_table()
+            group = self.client_columns(import_table)
+            frequency = func.count().label('frequency')
+            return self.with_labels(select(*group, frequency).group_by(*group)
+                                    .order_by(frequency.desc()).limit(bindparam('limit', type_=Integer)),
+                                    order_by=(('frequency', True),))
+
+        return self.execute_query(self.statement('top_user_agents', build), {'limit': N})
     
     def get_50x_errors(self, S, dT):
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-        timestamp = import_table.c.timestamp
-
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name} "
-                    f"FROM import "
-                    f"WHERE status_code LIKE '5%' AND timestamp >= NOW() - INTERVAL {dT} MINUTE "
-                    f"GROUP BY forwarded_for, referer, user_agent, balancer_worker_name")
-
-        return self.execute_query(query)
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_50x_errors', S, dT)
+        since = self.since(minutes=dT)
+
+        def build():
+            import_table = self.import_table(since)
+            group = self.client_columns(import_table)
+            return self.with_labels(select(*group)
+                                    .where(import_table.c.status_code.between(500, 599),
+                                           import_table.c.timestamp >= bindparam('since', type_=DateTime))
+                                    .group_by(*group))
+
+        return self.execute_query(self.statement('50x_errors', build, since), {'since': since})
     
     def get_longest_or_shortest_queries(self, N, longest=True):
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-        time_taken = import_table.c.time_taken
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_longest_or_shortest_queries', N, longest=longest)
 
-        sort_order = "DESC" if longest else "ASC"
+        def build():
+            import_table = self.import_table()
+            time_taken = import_table.c.time_taken
+            return self.with_labels(select(*self.client_columns(import_table), time_taken)
+                                    .order_by(time_taken.desc() if longest else time_taken.asc())
+                                    .limit(bindparam('limit', type_=Integer)),
+                                    order_by=(('time_taken', longest),), hidden=('time_taken',))
 
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name} "
-                    f"FROM import "
-                    f"ORDER BY time_taken {sort_order} "
-                    f"LIMIT {N}")
-
-        return self.execute_query(query)
+        query = self.statement(('longest_or_shortest_queries', longest), build)
+        return self.execute_query(query, {'limit': N})
     
-    def get_top_requests_to_kth_slash(self, N, K):
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-        request = import_table.c.request
-
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name} "
-                    f"FROM import "
-                    f"WHERE SUBSTRING_INDEX(SUBSTRING_INDEX(request, '/', {K+1}), '/', -1) = 'merlin-service-search' "
-                    f"GROUP BY forwarded_for, referer, user_agent, balancer_worker_name "
-                    f"ORDER BY COUNT(*) DESC "
-                    f"LIMIT {N}")
-
-        return self.execute_query(query)
+    def get_top_requests_to_kth_slash(self, N, K, segment='merlin-service-search'):
+        # Клиенты с наибольшим числом запросов, у которых K-й сегмент пути равен segment
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_top_requests_to_kth_slash', N, K, segment)
+        stored = 1 <= K <= LogParser.PATH_SEGMENTS
+
+        def build():
+            import_table = self.import_table()
+            group = self.client_columns(import_table)
+            if stored:
+                # Первые сегменты сохранены при импорте: условие идёт по индексу колонки
+                path_segment = import_table.c[f"path_seg{K}"]
+            else:
+                path_segment = SqlFunctions.split_part(import_table.c.path, '/', bindparam('k', type_=Integer))
+            request_count = func.count().label('request_count')
+            return self.with_labels(select(*group, request_count)
+                                    .where(path_segment == bindparam('segment'))
+                                    .group_by(*group)
+                                    .order_by(request_count.desc())
+                                    .limit(bindparam('limit', type_=Integer)),
+                                    order_by=(('request_count', True),), hidden=('request_count',))
+
+        query = self.statement(('top_requests_to_kth_slash', K if stored else None), build)
+        params = {'segment': segment, 'limit': N}
+        if not stored:
+            params['k'] = K
+        return self.execute_query(query, params)
     
     def get_upstream_requests(self):
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
+        if self.approximate:
+            return [group + (count,) for group, count in self.sketches().top_clients()]
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_upstream_requests')
+        if self.rollups_available():
+            query = self.statement('upstream_requests_rollup',
+                                   lambda: self._client_rollup_query(Rollup.CLIENT_COLUMNS, 'request_count'))
+            return self.execute_query(query)
 
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name}, COUNT(*) as request_count "
-                    f"FROM import "
-                    f"GROUP BY forwarded_for, referer, user_agent, balancer_worker_name")
+        def build():
+            import_table = self.import_table()
+            group = self.client_columns(import_table)
+            return self.with_labels(select(*group, func.count().label('request_count')).group_by(*group))
 
-        return self.execute_query(query)
+        return self.execute_query(self.statement('upstream_requests', build))
     
     def get_conversion_statistics(self, sort_by):
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name}, "
-                    f"SUBSTRING_INDEX(referer, '/', 3) AS domain, COUNT(*) AS transitions "
-                    f"FROM import "
-                    f"WHERE referer IS NOT NULL "
-                    f"GROUP BY forwarded_for, referer, user_agent, balancer_worker_name, domain "
-                    f"ORDER BY {sort_by}")
-
-        return self.execute_query(query)
-    
-    def get_outgoing_requests_30s(self):
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-        timestamp = import_table.c.timestamp
-
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name} "
-                    f"FROM import "
-                    f"WHERE timestamp >= NOW() - INTERVAL 30 SECOND")
-
-        with self.db_connection.engine.connect() as connection:
-            result = connection.execute(query)
-            return result.fetchall()
-        
-    def get_outgoing_requests_1m(self):
-        
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-        timestamp = import_table.c.timestamp
-
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name} "
-                    f"FROM import "
-                    f"WHERE timestamp >= NOW() - INTERVAL 1 MINUTE")
-
-        with self.db_connection.engine.connect() as connection:
-            result = connection.execute(query)
-            return result.fetchall()
-        
-    def get_outgoing_requests_5m(self):
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-        timestamp = import_table.c.timestamp
-
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name} "
-                    f"FROM import "
-                    f"WHERE timestamp >= NOW() - INTERVAL 5 MINUTE")
-
-        with self.db_connection.engine.connect() as connection:
-            result = connection.execute(query)
-            return result.fetchall()
-        
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_conversion_statistics', sort_by)
+        if sort_by not in Rollup.CLIENT_COLUMNS + ('domain', 'transitions'):
+            raise ValueError(f"Unsupported sort column: {sort_by}")
+
+        def build():
+            import_table = self.import_table()
+            group = self.client_columns(import_table)
+            (referer,) = self.client_columns(import_table, ('referer',))
+            # Домен referer вычислен при импорте
+            domain = import_table.c.referer_domain.label('domain')
+            transitions = func.count().label('transitions')
+            order = {'domain': domain, 'transitions': transitions}.get(sort_by)
+            return self.with_labels(select(*group, domain, transitions)
+                                    .where(referer.is_not(None))
+                                    .group_by(*group, domain)
+                                    .order_by(order if order is not None
+                                              else self.client_columns(import_table, (sort_by,))[0]),
+                                    order_by=((sort_by, False),))
+
+        return self.execute_query(self.statement(('conversion_statistics', sort_by), build))
+
+    def get_outgoing_requests(self, seconds):
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_outgoing_requests', seconds)
+        since = self.since(seconds=seconds)
+
+        def build():
+            import_table = self.import_table(since)
+            return self.with_labels(select(*self.client_columns(import_table))
+                                    .where(import_table.c.timestamp >= bindparam('since', type_=DateTime)))
+
+        return self.execute_query(self.statement('outgoing_requests', build, since), {'since': since})
+
+    def get_live_traffic(self, seconds, group_by=LiveWindow.DIMENSIONS):
+        # Счётчики последних seconds секунд из памяти follow-режима, без запроса к базе:
+        # (значения group_by..., число запросов, сумма time_taken)
+        if self.db_connection.live_window is None:
+            raise ValueError("Live traffic needs follow mode with a sliding window")
+        return self.db_connection.live_window.counts(seconds, group_by)
+
     def get_largest_request_periods(self, N):
-        import_table = self.db_connection.metadata.tables['import']
-        forwarded_for = import_table.c.forwarded_for
-        referer = import_table.c.referer
-        user_agent = import_table.c.user_agent
-        balancer_worker_name = import_table.c.balancer_worker_name
-        timestamp = import_table.c.timestamp
-
-        query = text(f"SELECT {forwarded_for}, {referer}, {user_agent}, {balancer_worker_name} "
-                    f"FROM import "
-                    f"GROUP BY DATE_FORMAT(timestamp, '%Y-%m-%d %H:%i'), "
-                    f"TIME_FORMAT(timestamp, '%H:%i') "
-                    f"ORDER BY COUNT(*) DESC "
-                    f"LIMIT {N}")
-
-        return self.execute_query(query)
-    
\ No newline at end of file
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_largest_request_periods', N)
+
+        def build():
+            # Самые нагруженные минуты, для каждой - её первая строка
+            import_table = self.import_table()
+            minute = SqlFunctions.minute_bucket(import_table.c.timestamp)
+            request_count = func.count().label('request_count')
+            periods = (select(func.min(import_table.c.id).label('first_id'), request_count)
+                       .group_by(minute)
+                       .order_by(request_count.desc())
+                       .limit(bindparam('limit', type_=Integer))
+                       .subquery())
+            return self.with_labels(select(*self.client_columns(import_table), periods.c.request_count)
+                                    .join_from(import_table, periods, import_table.c.id == periods.c.first_id)
+                                    .order_by(periods.c.request_count.desc()),
+                                    order_by=(('request_count', True),), hidden=('request_count',))
+
+        return self.execute_query(self.statement('largest_request_periods', build), {'limit': N})
+
+    def get_traffic_by_minute(self, dT=None, status_class=None, balancer_worker_name=None, path_prefix=None):
+        if self.db_type in STORE_BACKENDS:
+            return self.store_report('get_traffic_by_minute', dT=dT, status_class=status_class, balancer_worker_name=balancer_worker_name, path_prefix=path_prefix)
+        # Поминутный ряд из роллапа: число запросов, сумма и максимум time_taken
+        filters = {'minute': dT is not None, 'status_class': status_class is not None,
+                   'balancer_worker_name': balancer_worker_name is not None, 'path_prefix': path_prefix is not None}
+
+        def build():
+            minute_table, _ = Rollup.define_rollup_tables(self.db_connection.metadata)
+            columns = minute_table.c
+            query = select(columns.minute,
+                           cast(func.sum(columns.request_count), BigInteger).label('request_count'),
+                           cast(func.sum(columns.time_taken_sum), BigInteger).label('time_taken_sum'),
+                           func.max(columns.time_taken_max).label('time_taken_max'))
+            if filters['minute']:
+                query = query.where(columns.minute >= bindparam('since', type_=DateTime))
+            for name in ('status_class', 'balancer_worker_name', 'path_prefix'):
+                if filters[name]:
+                    query = query.where(columns[name] == bindparam(name))
+            return query.group_by(columns.minute).order_by(columns.minute)
+
+        params = {'status_class': status_class, 'balancer_worker_name': balancer_worker_name, 'path_prefix': path_prefix}
+        if dT is not None:
+            params['since'] = self.since(minutes=dT).replace(second=0)
+        params = {name: value for name, value in params.items() if value is not None}
+        query = self.statement(('traffic_by_minute',) + tuple(sorted(filters.items())), build)
+        return self.execute_query(query, params)
+
+    def get_latency_percentiles(self, group_by=None, percentiles=LatencyHistogram.PERCENTILES):
+        # Перцентили time_taken по balancer_worker_name, path_prefix или minute за один потоковый
+        # проход с лог-гистограммами: память - число групп * число корзин, без сортировки таблицы
+        (result,) = self.run_fused([('get_latency_percentiles', (group_by, percentiles))])
+        return result
+
+    def get_latency_histogram(self, group_by=None):
+        # Корзины (группа, нижняя граница, верхняя граница, число запросов) для слияния между запусками
+        (result,) = self.run_fused([('get_latency_histogram', (group_by,))])
+        return result
+
+    def get_distinct_counts(self):
+        # (колонка, оценка числа различных значений, относительная ошибка)
+        return self.sketches().distinct_counts()
+
+    def get_latency_quantiles(self, qs=(0.5, 0.9, 0.99, 0.999)):
+        return self.sketches().quantiles(qs)
+
+    def get_sketch_error_bounds(self):
+        return self.sketches().error_bounds()
+
+    @log_execution_time
+    def run_fused(self, reports, log_files=None, workers=1):
+        # Все отчёты из reports (список (имя метода, аргументы)) за один проход по данным:
+        # по сырым лог-файлам (путь, шаблон glob или их список), если они указаны, иначе по импортированным строкам
+        scanner = FusedScan.FusedScanner(reports)
+        if log_files is None:
+            return scanner.run(FusedScan.rows_from_store(self))
+        log_files = LogFiles.expand(log_files)
+        if workers > 1 and len(log_files) == 1 and not LogFiles.is_compressed(log_files[0]):
+            batches = ParallelImport.parse_file_parallel(log_files[0], workers, self.partition_size)
+        elif workers > 1:
+            ranges = [(log_file, 0, LogFiles.data_end(log_file)) for log_file in log_files]
+            batches = ParallelImport.parse_files_parallel(ranges, workers, self.partition_size)
+        else:
+            batches = (batch for log_file in log_files for batch in LogParser.parse_file(log_file, self.partition_size))
+        return scanner.run(FusedScan.rows_from_batches(batches))
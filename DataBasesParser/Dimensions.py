@@ -0,0 +1,131 @@
+import hashlib
+from collections import OrderedDict
+
+from sqlalchemy import Column, Index, Integer, String, Table, Text, inspect, select
+
+from DataBasesParser import Metrics, SqlFunctions
+
+# Нормализованная схема: длинные повторяющиеся строки хранятся один раз в таблицах измерений
+# dim_<колонка> (id, value), а import - только их целочисленные ключи <колонка>_id
+DIMENSION_COLUMNS = ('forwarded_for', 'referer', 'user_agent')
+KEY_COLUMNS = {f"{column}_id": column for column in DIMENSION_COLUMNS}
+# Размер списка IN в запросе поиска id (ограничение числа параметров SQLite)
+LOOKUP_CHUNK = 500
+
+
+def key_column(column):
+    return f"{column}_id"
+
+
+def value_hash(value):
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def define_dimension_table(metadata, column):
+    name = f"dim_{column}"
+    if name in metadata.tables:
+        return metadata.tables[name]
+    table = Table(name, metadata,
+                  Column('id', Integer, primary_key=True, autoincrement=True),
+                  Column('value_hash', String(32), nullable=False),
+                  Column('value', Text(length=3000)))
+    # Уникальность строки держится на её хеше: уникальный индекс по длинному тексту MySQL строит
+    # только по префиксу, а B-tree PostgreSQL не принимает ключи длиннее ~2700 байт. Поэтому два
+    # импорта одновременно не заведут одной строке два id
+    Index(f"ux_{name}_value_hash", table.c.value_hash, unique=True)
+    return table
+
+
+def has_value_hashes(inspector):
+    # Таблицы измерений прежней версии без value_hash могли накопить дубли строк
+    return all('value_hash' in {column['name'] for column in inspector.get_columns(f"dim_{column}")}
+               for column in DIMENSION_COLUMNS if inspector.has_table(f"dim_{column}"))
+
+
+def decoded(source, metadata):
+    # Все колонки source, где ключи измерений заменены их строками (LEFT JOIN по id)
+    joined = source
+    columns = []
+    for column in source.c:
+        dimension = KEY_COLUMNS.get(column.name)
+        if dimension is None:
+            columns.append(column)
+            continue
+        labels = define_dimension_table(metadata, dimension).alias(f"{dimension}_dim")
+        joined = joined.outerjoin(labels, labels.c.id == column)
+        columns.append(labels.c.value.label(dimension))
+    return select(*columns).select_from(joined)
+
+
+class DimensionEncoder:
+    # Строка -> id измерения. Недавние значения хранятся в LRU процесса, поэтому повторяющиеся
+    # строки не идут в базу; промахи пачки ищутся одним запросом, новые значения вставляются пачкой
+    def __init__(self, metadata, cache_size=100000):
+        self.tables = {column: define_dimension_table(metadata, column) for column in DIMENSION_COLUMNS}
+        self.cache_size = cache_size
+        self.caches = {column: OrderedDict() for column in DIMENSION_COLUMNS}
+
+    def create(self, connection, clear=True):
+        if not has_value_hashes(inspect(connection)):
+            # import с ключами старых измерений к этому моменту уже пересоздан (см. create_import_table)
+            for table in self.tables.values():
+                table.drop(connection, checkfirst=True)
+        for column, table in self.tables.items():
+            table.create(connection, checkfirst=True)
+            if clear:
+                connection.execute(table.delete())
+                self.caches[column].clear()
+
+    def encode_rows(self, connection, rows, column_names):
+        # Строки загрузчика: в колонках-ключах измерений пока стоят строки, они заменяются на id
+        if not rows:
+            return rows
+        columns = list(zip(*rows))
+        for position, name in enumerate(column_names):
+            dimension = KEY_COLUMNS.get(name)
+            if dimension is not None:
+                columns[position] = self.encode(connection, dimension, columns[position])
+        return list(zip(*columns))
+
+    def encode(self, connection, column, values):
+        cache = self.caches[column]
+        ids = {}
+        missing = []
+        for value in set(values):
+            key = cache.get(value)
+            if key is None:
+                missing.append(value)
+            else:
+                cache.move_to_end(value)
+                ids[value] = key
+        if missing:
+            Metrics.METRICS.inc('dimension_cache_misses', len(missing))
+            found = self._lookup(connection, column, missing)
+            new = [value for value in missing if value not in found]
+            if new:
+                # Строку мог вставить параллельный импорт: такие строки пропускаются, а id всех новых
+                # значений перечитываются блокирующим чтением, которое видит последние закоммиченные строки
+                connection.execute(SqlFunctions.insert_ignore(connection, self.tables[column], 'value_hash'),
+                                   [{'value': value, 'value_hash': value_hash(value)} for value in new])
+                found.update(self._lookup(connection, column, new, locking=True))
+                Metrics.METRICS.inc('dimension_inserts', len(new))
+            ids.update(found)
+            cache.update(found)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return [ids[value] for value in values]
+
+    def _lookup(self, connection, column, values, locking=False):
+        # Поиск по уникальному хешу; берутся только точные совпадения строки
+        table = self.tables[column]
+        wanted = set(values)
+        found = {}
+        for start in range(0, len(values), LOOKUP_CHUNK):
+            hashes = [value_hash(value) for value in values[start:start + LOOKUP_CHUNK]]
+            query = select(table.c.id, table.c.value).where(table.c.value_hash.in_(hashes))
+            if locking:
+                query = query.with_for_update(read=True)
+            for key, value in connection.execute(query):
+                if value in wanted:
+                    found[value] = key
+        return found
@@ -0,0 +1,227 @@
+import heapq
+import time
+from collections import Counter
+
+from DataBasesParser import Dimensions, LatencyHistogram, LogParser, Rollup
+from sqlalchemy import select
+
+# Строка для агрегаторов: (порядковый номер, группа клиента, epoch, status_code, time_taken, request)
+ORDINAL, CLIENT, EPOCH, STATUS, TIME_TAKEN, REQUEST = range(6)
+IP_ORDER = (0, 2, 1, 3)  # forwarded_for, user_agent, referer, balancer_worker_name
+
+
+def _top(counter, limit=None):
+    # Первые N групп по убыванию счётчика через кучу, без полной сортировки
+    if limit is None:
+        return sorted(counter.items(), key=lambda item: -item[1])
+    return heapq.nlargest(limit, counter.items(), key=lambda item: item[1])
+
+
+class GroupCount:
+    def __init__(self, limit=None, predicate=None, order=None, with_count=True):
+        self.counter = Counter()
+        self.limit = limit
+        self.predicate = predicate
+        self.order = order
+        self.with_count = with_count
+
+    def add(self, row):
+        if self.predicate is None or self.predicate(row):
+            self.counter[row[CLIENT]] += 1
+
+    def result(self):
+        rows = []
+        for client, count in _top(self.counter, self.limit):
+            if self.order is not None:
+                client = tuple(client[index] for index in self.order)
+            rows.append(client + (count,) if self.with_count else client)
+        return rows
+
+
+class DistinctGroups(GroupCount):
+    # GROUP BY без агрегата: группы в порядке первого появления
+    def __init__(self, predicate):
+        super().__init__(predicate=predicate, with_count=False)
+        self.counter = {}
+
+    def add(self, row):
+        if self.predicate(row):
+            self.counter.setdefault(row[CLIENT], 1)
+
+    def result(self):
+        return list(self.counter)
+
+
+class LongestOrShortest:
+    def __init__(self, limit, longest=True):
+        self.limit = limit
+        self.sign = 1 if longest else -1
+        self.heap = []
+
+    def add(self, row):
+        # Куча из N элементов: при равном time_taken выигрывает более ранняя строка
+        item = (self.sign * row[TIME_TAKEN], -row[ORDINAL], row[CLIENT])
+        if len(self.heap) < self.limit:
+            heapq.heappush(self.heap, item)
+        elif item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+
+    def result(self):
+        return [client for _, _, client in sorted(self.heap, reverse=True)]
+
+
+class ConversionStatistics:
+    SORT_INDEX = {'forwarded_for': 0, 'referer': 1, 'user_agent': 2, 'balancer_worker_name': 3,
+                  'domain': 4, 'transitions': 5}
+
+    def __init__(self, sort_by):
+        self.sort_index = self.SORT_INDEX[sort_by]
+        self.counter = Counter()
+
+    def add(self, row):
+        if row[CLIENT][1] is not None:
+            self.counter[row[CLIENT]] += 1
+
+    def result(self):
+        rows = [client + (LogParser.referer_domain(client[1]), count)
+                for client, count in self.counter.items()]
+        return sorted(rows, key=lambda row: row[self.sort_index])
+
+
+class WindowRows:
+    def __init__(self, since):
+        self.since = since
+        self.rows = []
+
+    def add(self, row):
+        if row[EPOCH] >= self.since:
+            self.rows.append(row[CLIENT])
+
+    def result(self):
+        return self.rows
+
+
+class LargestPeriods:
+    def __init__(self, limit):
+        self.limit = limit
+        self.counter = Counter()
+        self.first = {}
+
+    def add(self, row):
+        minute = row[EPOCH] // 60
+        self.counter[minute] += 1
+        self.first.setdefault(minute, row[CLIENT])
+
+    def result(self):
+        return [self.first[minute] for minute, _ in _top(self.counter, self.limit)]
+
+
+class LatencyPercentiles:
+    def __init__(self, group_by=None, percentiles=LatencyHistogram.PERCENTILES, buckets=False):
+        self.histograms = LatencyHistogram.GroupedHistograms(group_by)
+        self.percentiles = percentiles
+        self.buckets = buckets
+
+    def add(self, row):
+        self.histograms.add(row[EPOCH], row[CLIENT][3], row[REQUEST], row[TIME_TAKEN])
+
+    def result(self):
+        if self.buckets:
+            return self.histograms.buckets()
+        return self.histograms.percentiles(self.percentiles)
+
+
+class FusedScanner:
+    # Все запрошенные отчёты считаются за один проход: каждая строка отдаётся всем агрегаторам
+    def __init__(self, reports, now=None):
+        self.now = int(now if now is not None else time.time())
+        self.aggregators = [self.create_aggregator(method_name, args) for method_name, args in reports]
+
+    def since(self, seconds):
+        return self.now - seconds
+
+    def create_aggregator(self, method_name, args):
+        if method_name == 'get_ip_user_agent_statistics':
+            return GroupCount(limit=args[0], order=IP_ORDER)
+        if method_name == 'get_request_frequency':
+            since = self.since(args[0] * 60)
+            return GroupCount(predicate=lambda row: row[EPOCH] >= since)
+        if method_name == 'get_top_user_agents':
+            return GroupCount(limit=args[0])
+        if method_name == 'get_50x_errors':
+            since = self.since(args[1] * 60)
+            return DistinctGroups(lambda row: 500 <= row[STATUS] <= 599 and row[EPOCH] >= since)
+        if method_name == 'get_longest_or_shortest_queries':
+            return LongestOrShortest(*args)
+        if method_name == 'get_top_requests_to_kth_slash':
+            limit, K = args[:2]
+            segment = args[2] if len(args) > 2 else 'merlin-service-search'
+            return GroupCount(limit=limit, with_count=False,
+                              predicate=lambda row: LogParser.request_segment(row[REQUEST], K) == segment)
+        if method_name == 'get_upstream_requests':
+            return GroupCount()
+        if method_name == 'get_conversion_statistics':
+            return ConversionStatistics(*args)
+        if method_name == 'get_outgoing_requests':
+            return WindowRows(self.since(args[0]))
+        if method_name == 'get_largest_request_periods':
+            return LargestPeriods(*args)
+        if method_name == 'get_latency_percentiles':
+            return LatencyPercentiles(*args)
+        if method_name == 'get_latency_histogram':
+            return LatencyPercentiles(*args[:1], buckets=True)
+        raise ValueError(f"Report {method_name} is not supported in fused mode")
+
+    def run(self, rows):
+        adders = [aggregator.add for aggregator in self.aggregators]
+        for row in rows:
+            for add in adders:
+                add(row)
+        return [aggregator.result() for aggregator in self.aggregators]
+
+
+def rows_from_batches(batches):
+    # Кортежи разбора LogParser (все поля - строки, timestamp в формате Apache)
+    ordinal = 0
+    for batch in batches:
+        for data in batch:
+            try:
+                row = (ordinal, Rollup.client_group(data), LogParser.parse_epoch(data[LogParser.TIMESTAMP]),
+                       int(data[LogParser.STATUS_CODE]), int(data[LogParser.TIME_TAKEN]), data[LogParser.REQUEST])
+            except ValueError:
+                continue
+            ordinal += 1
+            yield row
+
+
+def rows_from_table(analyzer):
+    # Один потоковый проход по таблице import вместо отдельного запроса на каждый отчёт
+    import_table = analyzer.import_table()
+    if analyzer.db_connection.normalized:
+        import_table = Dimensions.decoded(import_table, analyzer.db_connection.metadata).subquery('import')
+    columns = [import_table.c[name] for name in Rollup.CLIENT_COLUMNS]
+    query = select(import_table.c.id, *columns, import_table.c.timestamp, import_table.c.status_code,
+                   import_table.c.time_taken, import_table.c.request).order_by(import_table.c.id)
+    for row in analyzer.stream_query(query):
+        yield (row[0], tuple(row[1:5]), int((row[5] - LogParser.EPOCH).total_seconds()), row[6], row[7], row[8])
+
+
+def rows_from_store(analyzer):
+    db_connection = analyzer.db_connection
+    if analyzer.db_type == 'columnar':
+        yield from rows_from_batches(db_connection.store.iter_batches())
+    elif analyzer.db_type == 'redis':
+        ordinal = 0
+        for partition in db_connection.store.iter_row_partitions(analyzer.partition_size):
+            for data in partition:
+                yield (ordinal, tuple(data[column] for column in Rollup.CLIENT_COLUMNS), int(data['timestamp']),
+                       int(data['status_code']), int(data['time_taken']), data['request'])
+                ordinal += 1
+    elif analyzer.db_type == 'mongodb':
+        cursor = db_connection.collection.find({}).sort('_id', 1).batch_size(analyzer.partition_size)
+        for ordinal, data in enumerate(cursor):
+            yield (ordinal, tuple(data[column] for column in Rollup.CLIENT_COLUMNS),
+                   int((data['timestamp'] - LogParser.EPOCH).total_seconds()),
+                   data['status_code'], data['time_taken'], data['request'])
+    else:
+        yield from rows_from_table(analyzer)
@@ -0,0 +1,121 @@
+import math
+from collections import Counter
+
+from DataBasesParser import LogParser, Rollup
+
+# Лог-линейные корзины в стиле HDR Histogram: каждая степень двойки делится на 2 ** SUB_BITS
+# равных корзин, поэтому ширина корзины не больше 1/64 её нижней границы, а середина корзины
+# отличается от любого значения в ней не больше чем на 0.8%. Раскладка корзин фиксирована,
+# поэтому гистограммы разных файлов, дней и процессов сливаются простым сложением счётчиков
+SUB_BITS = 6
+PERCENTILES = (50, 90, 99, 99.9)
+GROUP_BY = ('balancer_worker_name', 'path_prefix', 'minute')
+
+
+def bucket_index(value):
+    if value < (1 << SUB_BITS):
+        return max(value, 0)
+    shift = value.bit_length() - SUB_BITS - 1
+    return ((shift + 1) << SUB_BITS) + (value >> shift) - (1 << SUB_BITS)
+
+
+def bucket_bounds(index):
+    # Границы корзины [lower, upper] включительно
+    shift = (index >> SUB_BITS) - 1
+    if shift <= 0:
+        return index, index
+    lower = ((index & ((1 << SUB_BITS) - 1)) + (1 << SUB_BITS)) << shift
+    return lower, lower + (1 << shift) - 1
+
+
+class LogHistogram:
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+        self.total = sum(self.counts.values())
+        self.max = None
+
+    def add(self, value, count=1):
+        self.counts[bucket_index(value)] += count
+        self.total += count
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.total += other.total
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def percentiles(self, percentiles=PERCENTILES):
+        # Один проход по отсортированным корзинам на все перцентили сразу;
+        # значение перцентиля - середина корзины, в которую попал его ранг
+        values = [None] * len(percentiles)
+        if not self.total:
+            return values
+        targets = iter(sorted((max(1, math.ceil(p * self.total / 100)), position)
+                              for position, p in enumerate(percentiles)))
+        target, position = next(targets)
+        cumulative = 0
+        for index in sorted(self.counts):
+            cumulative += self.counts[index]
+            while target is not None and cumulative >= target:
+                lower, upper = bucket_bounds(index)
+                values[position] = (lower + upper) // 2 if self.max is None else min((lower + upper) // 2, self.max)
+                target, position = next(targets, (None, None))
+            if target is None:
+                break
+        return values
+
+    def buckets(self):
+        return [bucket_bounds(index) + (self.counts[index],) for index in sorted(self.counts)]
+
+    def to_dict(self):
+        return {'sub_bits': SUB_BITS, 'max': self.max, 'counts': {str(index): count for index, count in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('sub_bits') != SUB_BITS:
+            raise ValueError(f"Unsupported histogram layout: {data.get('sub_bits')} sub-bucket bits")
+        histogram = cls({int(index): count for index, count in data['counts'].items()})
+        histogram.max = data.get('max')
+        return histogram
+
+
+def group_key(group_by, epoch, worker, request):
+    if group_by == 'balancer_worker_name':
+        return worker
+    if group_by == 'path_prefix':
+        return Rollup.path_prefix(request)
+    if group_by == 'minute':
+        return LogParser.epoch_to_datetime(epoch // 60 * 60)
+    return None
+
+
+class GroupedHistograms:
+    # Гистограммы time_taken по значению группировки (None - по всем строкам)
+    def __init__(self, group_by=None):
+        if group_by is not None and group_by not in GROUP_BY:
+            raise ValueError(f"Unsupported latency grouping: {group_by}")
+        self.group_by = group_by
+        self.histograms = {}
+
+    def add(self, epoch, worker, request, time_taken):
+        key = group_key(self.group_by, epoch, worker, request)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LogHistogram()
+        histogram.add(time_taken)
+
+    def merge(self, other):
+        for key, histogram in other.histograms.items():
+            self.histograms.setdefault(key, LogHistogram()).merge(histogram)
+
+    def percentiles(self, percentiles=PERCENTILES):
+        # (группа, число запросов, перцентили...) в порядке группы
+        return [(key, histogram.total, *histogram.percentiles(percentiles))
+                for key, histogram in sorted(self.histograms.items(), key=lambda item: (item[0] is None, item[0]))]
+
+    def buckets(self):
+        return [(key, lower, upper, count)
+                for key, histogram in sorted(self.histograms.items(), key=lambda item: (item[0] is None, item[0]))
+                for lower, upper, count in histogram.buckets()]
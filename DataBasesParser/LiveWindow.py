@@ -0,0 +1,72 @@
+import time
+from collections import defaultdict
+
+from DataBasesParser import LogParser, Rollup
+
+# Измерения посекундных корзин: воркер балансировщика, класс статуса (2, 3, 4, 5), первый сегмент пути
+DIMENSIONS = ('balancer_worker_name', 'status_class', 'path_prefix')
+
+
+def _totals():
+    # [число запросов, сумма time_taken]
+    return [0, 0]
+
+
+class SlidingWindow:
+    # Кольцевой буфер посекундных счётчиков за последние capacity секунд, заполняется строками
+    # из follow-режима. Слот хранит свою секунду (epoch UTC) и счётчики по DIMENSIONS; слот
+    # с чужой секундой считается пустым и переиспользуется. Окно любой длины до capacity
+    # суммирует не больше capacity + 1 слотов, без запроса к базе
+    def __init__(self, capacity=3600):
+        self.capacity = capacity
+        # Окно [now - seconds, now] включает обе границы, как и условие timestamp >= since в SQL
+        self.size = capacity + 1
+        self.seconds = [None] * self.size
+        self.buckets = [None] * self.size
+
+    def _bucket(self, second):
+        slot = second % self.size
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.buckets[slot] = defaultdict(_totals)
+        return self.buckets[slot]
+
+    def add_batch(self, batch, now=None):
+        # Строки старше capacity секунд относительно текущего времени в окно уже не попадут
+        horizon = (int(time.time()) if now is None else now) - self.capacity
+        for data in batch:
+            try:
+                second = LogParser.parse_epoch(data[LogParser.TIMESTAMP])
+                if second < horizon:
+                    continue
+                time_taken = int(data[LogParser.TIME_TAKEN])
+                key = (data[LogParser.BALANCER_WORKER_NAME], int(data[LogParser.STATUS_CODE]) // 100,
+                       Rollup.path_prefix(data[LogParser.REQUEST]))
+            except ValueError:
+                continue
+            totals = self._bucket(second)[key]
+            totals[0] += 1
+            totals[1] += time_taken
+
+    def observe(self, batches):
+        for batch in batches:
+            self.add_batch(batch)
+            yield batch
+
+    def counts(self, seconds, group_by=DIMENSIONS, now=None):
+        # [(значения group_by..., число запросов, сумма time_taken)] за последние seconds секунд,
+        # по убыванию числа запросов; group_by=() - итог окна одной строкой
+        if not 0 < seconds <= self.capacity:
+            raise ValueError(f"Window must be between 1 and {self.capacity} seconds, got {seconds}")
+        indexes = [DIMENSIONS.index(name) for name in group_by]
+        now = int(time.time()) if now is None else now
+        groups = defaultdict(_totals)
+        for second in range(now - seconds, now + 1):
+            slot = second % self.size
+            if self.seconds[slot] != second:
+                continue
+            for key, (count, time_taken) in self.buckets[slot].items():
+                totals = groups[tuple(key[index] for index in indexes)]
+                totals[0] += count
+                totals[1] += time_taken
+        return sorted((group + tuple(totals) for group, totals in groups.items()), key=lambda row: -row[-2])
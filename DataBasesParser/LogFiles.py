@@ -0,0 +1,107 @@
+import bz2
+import glob
+import gzip
+import io
+import lzma
+import os
+import re
+
+# Набор лог-файлов импорта: пути и шаблоны glob, ротированные файлы (access_log.1.gz ... access_log.30.zst)
+# и потоковая распаковка без временных файлов
+ROTATION_PATTERN = re.compile(r'^(?P<base>.*?)(?:\.(?P<number>\d+))?$')
+# Служебные файлы рядом с логом, которые шаблон вроде access_log* тоже захватывает
+# (и их временные копии, которые пишутся перед атомарной заменой)
+SIDE_FILES = ('.checkpoints', '.checkpoints.tmp', '.checkpoint', '.checkpoint.tmp', '.sketches', '.sketches.tmp',
+              '.parsecache', '.parsecache.tmp')
+
+
+def _open_zstd(path):
+    # zstandard - необязательная зависимость, нужна только для .zst
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(f"Reading {path} requires the zstandard package (pip install zstandard)") from None
+    reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+    return io.BufferedReader(reader)
+
+
+OPENERS = {
+    '.gz': lambda path: gzip.open(path, 'rb'),
+    '.bz2': lambda path: bz2.open(path, 'rb'),
+    '.xz': lambda path: lzma.open(path, 'rb'),
+    '.zst': _open_zstd,
+}
+
+
+def compression(path):
+    return os.path.splitext(path)[1] if os.path.splitext(path)[1] in OPENERS else None
+
+
+def is_compressed(path):
+    return compression(path) is not None
+
+
+def open_log(path, start=0, block_size=1024 * 1024):
+    # Бинарный поток строк лога с позиции start; сжатый файл распаковывается на лету,
+    # и start в нём - позиция в распакованных данных (уже прочитанное пропускается)
+    suffix = compression(path)
+    if not suffix:
+        file = open(path, 'rb')
+        if start:
+            file.seek(start)
+        return file
+    file = OPENERS[suffix](path)
+    while start > 0:
+        skipped = len(file.read(min(block_size, start)))
+        if not skipped:
+            break
+        start -= skipped
+    return file
+
+
+def last_line_end(log_file, block_size=64 * 1024):
+    # Смещение сразу после последнего '\n': недописанная строка остаётся на следующий запуск
+    with open(log_file, 'rb') as file:
+        position = file.seek(0, os.SEEK_END)
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            file.seek(position)
+            index = file.read(size).rfind(b'\n')
+            if index != -1:
+                return position + index + 1
+    return 0
+
+
+def data_end(path):
+    # Граница импорта: для живого текстового лога - конец последней полной строки,
+    # сжатый ротированный файл уже не меняется и читается до конца потока (None)
+    if is_compressed(path):
+        return None
+    return last_line_end(path)
+
+
+def rotation_base(path):
+    # access_log.2.gz, access_log.1 и access_log - один набор access_log
+    return rotation_key(path)[0]
+
+
+def rotation_key(path):
+    # Сначала самые старые: access_log.30.zst, ..., access_log.1.gz, access_log
+    stem = path[:-len(compression(path))] if is_compressed(path) else path
+    match = ROTATION_PATTERN.match(stem)
+    return match.group('base'), -int(match.group('number') or 0), path
+
+
+def expand(patterns):
+    # Пути и шаблоны glob -> существующие файлы без повторов в порядке ротации
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    files = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) or ([pattern] if os.path.exists(pattern) else [])
+        if not matches:
+            raise FileNotFoundError(f"No log files match {pattern}")
+        files.extend(path for path in matches if os.path.isfile(path) and not path.endswith(SIDE_FILES))
+    return sorted(set(files), key=rotation_key)
+
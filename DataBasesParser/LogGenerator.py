@@ -0,0 +1,63 @@
+import itertools
+import random
+import time
+from datetime import datetime, timezone
+
+# Детерминированный генератор access-лога в формате LogParser.LOG_REGEX для бенчмарков.
+# При одинаковых параметрах и seed получается байт-в-байт тот же файл
+
+METHODS = ('GET', 'GET', 'GET', 'GET', 'POST', 'PUT', 'DELETE')
+STATUSES = (200, 200, 200, 200, 200, 200, 301, 304, 404, 500, 502, 503)
+SERVICES = ('merlin-service-search', 'catalog', 'users', 'orders', 'static', 'auth')
+
+
+class LogGenerator:
+    # cardinality - число различных значений колонки, skew - показатель распределения Ципфа
+    # (0 - равномерное, чем больше, тем сильнее доминируют первые значения)
+    def __init__(self, seed=1, skew=1.0, ips=1000, user_agents=200, referers=500, paths=2000,
+                 workers=8, span=3600, end=None, garbage_every=0):
+        self.random = random.Random(seed)
+        self.skew = skew
+        self.span = span
+        self.end = int(end if end is not None else time.time())
+        self.garbage_every = garbage_every
+        self.ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(1, ips + 1)]
+        self.forwarded = [f"192.168.{i >> 8 & 255}.{i & 255}" for i in range(1, ips + 1)]
+        self.user_agents = [f"Mozilla/5.0 (X11; Linux x86_64) Client/{i}.0" for i in range(user_agents)]
+        self.referers = ['-'] + [f"https://site{i % 97}.example/{SERVICES[i % len(SERVICES)]}/page{i}"
+                                 for i in range(referers - 1)]
+        self.paths = [f"/{'api' if i % 3 else 'v2'}/{SERVICES[i % len(SERVICES)]}/item{i}" for i in range(paths)]
+        self.workers = [str(i) for i in range(1, workers + 1)]
+
+    def _weights(self, size):
+        return list(itertools.accumulate(1.0 / (rank ** self.skew) for rank in range(1, size + 1)))
+
+    def _sampler(self, values):
+        weights = self._weights(len(values))
+        return lambda count: self.random.choices(values, cum_weights=weights, k=count)
+
+    def lines(self, rows, batch_size=10000):
+        ips = self._sampler(range(len(self.ips)))
+        user_agents = self._sampler(self.user_agents)
+        referers = self._sampler(self.referers)
+        paths = self._sampler(self.paths)
+        workers = self._sampler(self.workers)
+        written = 0
+        while written < rows:
+            count = min(batch_size, rows - written)
+            columns = zip(ips(count), user_agents(count), referers(count), paths(count), workers(count))
+            for ip, user_agent, referer, path, worker in columns:
+                written += 1
+                moment = datetime.fromtimestamp(self.end - self.random.randrange(self.span), timezone.utc)
+                query = f"?q={self.random.randrange(100)}" if self.random.random() < 0.3 else ''
+                yield (f'{self.ips[ip]} ({self.forwarded[ip]}) - - [{moment.strftime("%d/%b/%Y:%H:%M:%S +0000")}] '
+                       f'"{self.random.choice(METHODS)} {path}{query} HTTP/1.1" {self.random.choice(STATUSES)} '
+                       f'{self.random.randrange(10, 100000)} {int(self.random.lognormvariate(11, 1.2))} {worker} '
+                       f'"{referer}" "{user_agent}"\n')
+                if self.garbage_every and written % self.garbage_every == 0:
+                    yield "malformed line without the expected fields\n"
+
+    def write(self, path, rows):
+        with open(path, 'w') as file:
+            file.writelines(self.lines(rows))
+        return path
@@ -0,0 +1,124 @@
+import locale
+import re
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from DataBasesParser import LogFiles, Metrics
+
+LOG_REGEX = r'^(?P<ip_address>\S+) \((?P<forwarded_for>\S+)\) - - \[(?P<timestamp>[\w:/]+\s[+\-]\d{4})\] "(?P<request>[A-Z]+ \S+ \S+)" (?P<status_code>\d+) (?P<response_size>\d+) (?P<time_taken>\d+) (?P<balancer_worker_name>\d+) "(?P<referer>[^"]*)" "(?P<user_agent>[^"]*)"'
+LOG_PATTERN = re.compile(LOG_REGEX)
+# Разобранная строка - кортеж в порядке групп LOG_REGEX
+FIELDS = ('ip_address', 'forwarded_for', 'timestamp', 'request', 'status_code', 'response_size',
+          'time_taken', 'balancer_worker_name', 'referer', 'user_agent')
+IP_ADDRESS, FORWARDED_FOR, TIMESTAMP, REQUEST, STATUS_CODE, RESPONSE_SIZE, \
+    TIME_TAKEN, BALANCER_WORKER_NAME, REFERER, USER_AGENT = range(len(FIELDS))
+FIELD_INDEX = {name: index for index, name in enumerate(FIELDS)}
+
+EPOCH = datetime(1970, 1, 1)
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+          'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(value):
+    # dd/Mon/yyyy:HH:MM:SS +zzzz -> datetime в UTC без tzinfo
+    try:
+        moment = datetime(int(value[7:11]), MONTHS[value[3:6]], int(value[0:2]),
+                          int(value[12:14]), int(value[15:17]), int(value[18:20]))
+        offset = timedelta(hours=int(value[22:24]), minutes=int(value[24:26]))
+        return moment - offset if value[21] == '+' else moment + offset
+    except (KeyError, ValueError, IndexError):
+        moment = datetime.strptime(value, '%d/%b/%Y:%H:%M:%S %z')
+        return (moment - moment.utcoffset()).replace(tzinfo=None)
+
+
+@lru_cache(maxsize=4096)
+def parse_epoch(value):
+    return int((parse_timestamp(value) - EPOCH).total_seconds())
+
+
+# Сколько первых сегментов пути импорт хранит отдельными колонками path_seg1..path_segN
+PATH_SEGMENTS = 4
+# Колонки, вычисляемые из request при импорте: метод, путь, протокол и первые сегменты пути
+REQUEST_PARTS = ('method', 'path', 'protocol') + tuple(f"path_seg{k}" for k in range(1, PATH_SEGMENTS + 1))
+
+
+def path_segment(path, k):
+    # k-й сегмент пути ("/api/v1/users" -> 1: "api"); за последним сегментом - последний,
+    # как SUBSTRING_INDEX(SUBSTRING_INDEX(path, '/', k+1), '/', -1) в MySQL
+    parts = path.split('/')
+    return parts[k] if k < len(parts) else parts[-1]
+
+
+@lru_cache(maxsize=65536)
+def request_parts(request):
+    # "GET /api/v1/users HTTP/1.1" -> значения REQUEST_PARTS; LOG_REGEX гарантирует три части через пробел
+    method, path, protocol = request.split(' ', 2)
+    return (method, path, protocol) + tuple(path_segment(path, k) for k in range(1, PATH_SEGMENTS + 1))
+
+
+def request_part(name):
+    # Функция request -> значение колонки name из REQUEST_PARTS
+    index = REQUEST_PARTS.index(name)
+    return lambda request: request_parts(request)[index]
+
+
+def request_segment(request, k):
+    # k-й сегмент пути запроса для любого k
+    parts = request_parts(request)
+    return parts[3 + k - 1] if 1 <= k <= PATH_SEGMENTS else path_segment(parts[1], k)
+
+
+def referer_domain(referer):
+    # "https://example.com/page" -> "https://example.com", как SUBSTRING_INDEX(referer, '/', 3)
+    return '/'.join(referer.split('/')[:3])
+
+
+def epoch_to_datetime(epoch):
+    return EPOCH + timedelta(seconds=epoch)
+
+
+def parse_lines(lines):
+    rows = []
+    for line in lines:
+        match = LOG_PATTERN.match(line)
+        if match:
+            rows.append(match.groups())
+    return rows
+
+
+def parse_file(log_file, batch_size=1000, start=0, end=None):
+    # Последовательный разбор диапазона байт [start, end) построчно регулярным выражением:
+    # пачки кортежей по batch_size строк. Сжатый файл читается с позиции start в распакованных данных до конца
+    if LogFiles.is_compressed(log_file):
+        end = None
+    encoding = locale.getpreferredencoding(False)
+    batch = []
+    # Счётчики копятся локально и сбрасываются в Metrics.METRICS на каждой пачке
+    reported = start
+    lines = 0
+    with LogFiles.open_log(log_file, start) as file:
+        position = start
+        for line in file:
+            if end is not None and position + len(line) > end:
+                break
+            position += len(line)
+            lines += 1
+            match = LOG_PATTERN.match(line.decode(encoding))
+            if match:
+                batch.append(match.groups())
+                if len(batch) >= batch_size:
+                    record_parse(position - reported, lines, len(batch))
+                    reported, lines = position, 0
+                    yield batch
+                    batch = []
+    record_parse(position - reported, lines, len(batch))
+    if batch:
+        yield batch
+
+
+def record_parse(bytes_read, lines, matches):
+    Metrics.METRICS.inc('parser_bytes_read', bytes_read)
+    Metrics.METRICS.inc('parser_lines_read', lines)
+    Metrics.METRICS.inc('parser_regex_matches', matches)
+    Metrics.METRICS.inc('parser_regex_misses', lines - matches)
@@ -0,0 +1,158 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+
+class Metrics:
+    # Счётчики, значения (gauge) и таймеры этапов импорта и запросов.
+    # Таймер хранит число замеров, сумму и максимум в секундах
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {'counters': dict(self.counters), 'gauges': dict(self.gauges),
+                    'timers': {name: {'count': count, 'sum_seconds': round(total, 6), 'max_seconds': round(maximum, 6)}
+                               for name, (count, total, maximum) in self.timers.items()}}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='dbparser'):
+        # Текстовый формат Prometheus: counter, gauge и summary без квантилей
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = _metric_name(prefix, name) + '_total'
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, value in sorted(snapshot['gauges'].items()):
+            metric = _metric_name(prefix, name)
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        for name, timer in sorted(snapshot['timers'].items()):
+            metric = _metric_name(prefix, name) + '_seconds'
+            lines += [f"# TYPE {metric} summary", f"{metric}_count {timer['count']}",
+                      f"{metric}_sum {timer['sum_seconds']}",
+                      f"# TYPE {metric}_max gauge", f"{metric}_max {timer['max_seconds']}"]
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, format='json'):
+        with open(path, 'w') as file:
+            file.write(self.to_prometheus() if format == 'prometheus' else self.to_json())
+
+
+def _metric_name(prefix, name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', f"{prefix}_{name}")
+
+
+# Общий реестр процесса
+METRICS = Metrics()
+
+
+def conversion_errors(count, sample, metrics=METRICS):
+    # Строки с непреобразуемыми полями пропускаются: счётчик conversion_errors и одно
+    # предупреждение на пачку с первой ошибкой, а не вывод на каждую строку
+    if count:
+        metrics.inc('conversion_errors', count)
+        logging.getLogger(__name__).warning(f"Skipped {count} rows with unconvertible fields, first error: {sample}")
+
+
+def instrument_engine(engine, metrics=METRICS):
+    # Время от вызова execute до курсора - компиляция выражения (или попадание в кеш),
+    # время курсора - выполнение на сервере, каждое обращение к курсору - round trip
+    @event.listens_for(engine, 'before_execute')
+    def _before_execute(connection, clauseelement, multiparams, params, execution_options):
+        connection.info.setdefault('metrics_execute_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_execute')
+    def _after_execute(connection, clauseelement, multiparams, params, execution_options, result):
+        starts = connection.info.get('metrics_execute_start')
+        if starts:
+            starts.pop()
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        now = time.perf_counter()
+        starts = connection.info.get('metrics_execute_start')
+        if starts:
+            metrics.observe('query_compile', now - starts[-1])
+        connection.info['metrics_cursor_start'] = now
+        metrics.inc('db_round_trips')
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        start_time = connection.info.pop('metrics_cursor_start', None)
+        if start_time is not None:
+            metrics.observe('query_execute', time.perf_counter() - start_time)
+
+
+@contextmanager
+def profile(stage, output=None, limit=30, logger=None):
+    # cProfile и tracemalloc на время этапа; отчёт пишется в output или в лог
+    logger = logger or logging.getLogger(__name__)
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        report = io.StringIO()
+        report.write(f"=== Profile of {stage}: peak traced memory {peak / 1024 / 1024:.1f} MB, "
+                     f"still allocated {current / 1024 / 1024:.1f} MB ===\n")
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(limit)
+        report.write("Top allocations:\n")
+        for statistic in snapshot.statistics('lineno')[:10]:
+            report.write(f"  {statistic}\n")
+        if output:
+            with open(output, 'a') as file:
+                file.write(report.getvalue())
+        else:
+            logger.info(report.getvalue())
@@ -0,0 +1,175 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+from DataBasesParser import LogParser, Metrics, Rollup
+
+# Значения pymongo.ASCENDING и DESCENDING: pymongo загружается только при подключении к MongoDB
+ASCENDING = 1
+DESCENDING = -1
+
+GROUP_ID = {column: f"${column}" for column in Rollup.CLIENT_COLUMNS}
+CLIENT_PROJECTION = dict({column: 1 for column in Rollup.CLIENT_COLUMNS}, _id=0)
+INDEXES = (
+    [('timestamp', ASCENDING)],
+    [('status_code', ASCENDING), ('timestamp', ASCENDING)],
+    [('time_taken', DESCENDING)],
+    [(column, ASCENDING) for column in Rollup.CLIENT_COLUMNS],
+) + tuple([(f"path_seg{k}", ASCENDING)] for k in range(1, LogParser.PATH_SEGMENTS + 1))
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def _split_part(field, K):
+    # То же, что SUBSTRING_INDEX(SUBSTRING_INDEX(field, '/', K+1), '/', -1) в MySQL
+    return {'$let': {
+        'vars': {'parts': {'$split': [field, '/']}},
+        'in': {'$cond': [{'$lt': [K, {'$size': '$$parts'}]},
+                         {'$arrayElemAt': ['$$parts', K]},
+                         {'$arrayElemAt': ['$$parts', -1]}]}}}
+
+
+class MongoStore:
+    def __init__(self, db, batch_size=1000):
+        self.collection = db['import']
+        # Служебные отметки импорта (generation - см. ResultCache)
+        self.meta = db['import_meta']
+        self.batch_size = batch_size
+
+    def create_indexes(self):
+        for keys in INDEXES:
+            self.collection.create_index(keys)
+
+    def clear(self):
+        self.collection.delete_many({})
+        self.create_indexes()
+
+    def get_generation(self):
+        document = self.meta.find_one({'_id': 'generation'})
+        return document['stamp'] if document else None
+
+    def set_generation(self, stamp):
+        self.meta.replace_one({'_id': 'generation'}, {'stamp': stamp}, upsert=True)
+
+    def write_batch(self, batch):
+        documents = []
+        errors = 0
+        sample = None
+        for data in batch:
+            try:
+                # Части request и домен referer вычисляются при импорте, как колонки таблицы import в SQL
+                documents.append(dict(zip(LogParser.FIELDS, data),
+                                      **dict(zip(LogParser.REQUEST_PARTS, LogParser.request_parts(data[LogParser.REQUEST]))),
+                                      timestamp=LogParser.parse_timestamp(data[LogParser.TIMESTAMP]),
+                                      status_code=int(data[LogParser.STATUS_CODE]),
+                                      response_size=int(data[LogParser.RESPONSE_SIZE]),
+                                      time_taken=int(data[LogParser.TIME_TAKEN]),
+                                      referer_domain=LogParser.referer_domain(data[LogParser.REFERER])))
+            except ValueError as e:
+                errors += 1
+                sample = sample or e
+        Metrics.conversion_errors(errors, sample)
+        if documents:
+            # Неупорядоченная вставка: сервер пишет документы пачкой и не останавливается на первой ошибке
+            self.collection.insert_many(documents, ordered=False)
+            Metrics.METRICS.inc('db_round_trips')
+        return len(documents)
+
+    def aggregate(self, pipeline, batch_size=None):
+        return self.collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size or self.batch_size)
+
+    def _group(self, match=None, limit=None, batch_size=None):
+        pipeline = [{'$match': match}] if match else []
+        pipeline.append({'$group': {'_id': GROUP_ID, 'count': {'$sum': 1}}})
+        if limit is not None:
+            pipeline += [{'$sort': {'count': -1}}, {'$limit': limit}]
+        return self.aggregate(pipeline, batch_size)
+
+    @staticmethod
+    def _rows(rows, partition_size):
+        # partition_size задан в потоковом режиме: строки отдаются генератором по мере чтения
+        # курсора, который получает с сервера пакеты по partition_size документов
+        return list(rows) if partition_size is None else rows
+
+    @staticmethod
+    def _client_row(group, *columns):
+        return tuple(group.get(column) for column in columns or Rollup.CLIENT_COLUMNS)
+
+    def _since(self, **delta):
+        return {'timestamp': {'$gte': _utcnow() - timedelta(**delta)}}
+
+    def get_ip_user_agent_statistics(self, n):
+        columns = ('forwarded_for', 'user_agent', 'referer', 'balancer_worker_name')
+        return [self._client_row(row['_id'], *columns) + (row['count'],) for row in self._group(limit=n)]
+
+    def get_request_frequency(self, dT, partition_size=None):
+        pipeline = [{'$match': self._since(minutes=dT)},
+                    {'$group': {'_id': GROUP_ID, 'count': {'$sum': 1}}},
+                    {'$sort': {'count': -1}}]
+        return self._rows((self._client_row(row['_id']) + (row['count'],)
+                           for row in self.aggregate(pipeline, partition_size)), partition_size)
+
+    def get_top_user_agents(self, N):
+        return [self._client_row(row['_id']) + (row['count'],) for row in self._group(limit=N)]
+
+    def get_50x_errors(self, S, dT, partition_size=None):
+        match = dict(self._since(minutes=dT), status_code={'$gte': 500, '$lte': 599})
+        return self._rows((self._client_row(row['_id']) for row in self._group(match, batch_size=partition_size)),
+                          partition_size)
+
+    def get_longest_or_shortest_queries(self, N, longest=True):
+        cursor = self.collection.find({}, CLIENT_PROJECTION).sort(
+            'time_taken', DESCENDING if longest else ASCENDING).limit(N)
+        return [self._client_row(document) for document in cursor]
+
+    def get_top_requests_to_kth_slash(self, N, K, segment='merlin-service-search'):
+        if 1 <= K <= LogParser.PATH_SEGMENTS:
+            match = {f"path_seg{K}": segment}
+        else:
+            match = {'$expr': {'$eq': [_split_part('$path', K), segment]}}
+        return [self._client_row(row['_id']) for row in self._group(match, limit=N)]
+
+    def get_upstream_requests(self, partition_size=None):
+        return self._rows((self._client_row(row['_id']) + (row['count'],)
+                           for row in self._group(batch_size=partition_size)), partition_size)
+
+    def get_conversion_statistics(self, sort_by, partition_size=None):
+        sort_field = {'domain': '_id.domain', 'transitions': 'count'}.get(sort_by, f"_id.{sort_by}")
+        pipeline = [{'$match': {'referer': {'$ne': None}}},
+                    {'$group': {'_id': dict(GROUP_ID, domain='$referer_domain'), 'count': {'$sum': 1}}},
+                    {'$sort': {sort_field: 1}}]
+        return self._rows((self._client_row(row['_id']) + (row['_id']['domain'], row['count'])
+                           for row in self.aggregate(pipeline, partition_size)), partition_size)
+
+    def get_outgoing_requests(self, seconds, partition_size=None):
+        cursor = self.collection.find(self._since(seconds=seconds), CLIENT_PROJECTION).batch_size(
+            partition_size or self.batch_size)
+        return self._rows((self._client_row(document) for document in cursor), partition_size)
+
+    def get_largest_request_periods(self, N):
+        minute = {'$dateToString': {'format': '%Y-%m-%d %H:%M', 'date': '$timestamp'}}
+        pipeline = [{'$group': dict({'_id': minute, 'count': {'$sum': 1}},
+                                    **{column: {'$first': f"${column}"} for column in Rollup.CLIENT_COLUMNS})},
+                    {'$sort': {'count': -1}},
+                    {'$limit': N}]
+        return [self._client_row(row) for row in self.aggregate(pipeline)]
+
+    def get_traffic_by_minute(self, dT=None, status_class=None, balancer_worker_name=None, path_prefix=None):
+        match = {}
+        if dT is not None:
+            match['timestamp'] = {'$gte': _utcnow().replace(second=0) - timedelta(minutes=dT)}
+        if status_class is not None:
+            match['status_code'] = {'$gte': status_class * 100, '$lte': status_class * 100 + 99}
+        if balancer_worker_name is not None:
+            match['balancer_worker_name'] = balancer_worker_name
+        if path_prefix is not None:
+            match['request'] = {'$regex': f"^[A-Z]+ {re.escape(path_prefix)}([/? ]|$)"}
+        minute = {'$dateToString': {'format': '%Y-%m-%d %H:%M', 'date': '$timestamp'}}
+        pipeline = [{'$match': match},
+                    {'$group': {'_id': minute, 'count': {'$sum': 1},
+                                'time_taken_sum': {'$sum': '$time_taken'},
+                                'time_taken_max': {'$max': '$time_taken'}}},
+                    {'$sort': {'_id': 1}}]
+        return [(datetime.strptime(row['_id'], '%Y-%m-%d %H:%M'), row['count'], row['time_taken_sum'], row['time_taken_max'])
+                for row in self.aggregate(pipeline)]
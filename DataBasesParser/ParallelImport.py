@@ -0,0 +1,123 @@
+import locale
+import multiprocessing
+import os
+from collections import deque
+
+from DataBasesParser import LogFiles, LogParser, Metrics
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def split_file(log_file, chunk_size=CHUNK_SIZE, start=0, end=None):
+    # Делим файл на диапазоны байт, границы выравниваются по концу строки
+    if end is None:
+        end = os.path.getsize(log_file)
+    ranges = []
+    with open(log_file, 'rb') as file:
+        while start < end:
+            stop = start + chunk_size
+            if stop >= end:
+                stop = end
+            else:
+                file.seek(stop)
+                file.readline()
+                stop = min(file.tell(), end)
+            ranges.append((start, stop))
+            start = stop
+    return ranges
+
+
+def parse_chunk(task):
+    log_file, start, stop, encoding = task
+    with open(log_file, 'rb') as file:
+        file.seek(start)
+        data = file.read(stop - start)
+    # Метрики дочернего процесса не видны родителю, поэтому число строк возвращается вместе с ними
+    return LogParser.parse_lines(data.decode(encoding).split('\n')), data.count(b'\n')
+
+
+_results = None
+
+
+def _init_stream_worker(results):
+    global _results
+    _results = results
+    # Счётчики разбора копятся в копии реестра дочернего процесса и уходят родителю с концом задачи
+    Metrics.METRICS.reset()
+
+
+def stream_task(task):
+    # Распаковка и разбор одного файла (или куска несжатого) с передачей пачек через общую очередь
+    log_file, start, stop, batch_size = task
+    try:
+        for batch in LogParser.parse_file(log_file, batch_size, start, stop):
+            _results.put(('batch', batch))
+        counters = Metrics.METRICS.snapshot()['counters']
+        Metrics.METRICS.reset()
+        _results.put(('done', counters))
+    except Exception as e:
+        _results.put(('error', f"{log_file}: {type(e).__name__}: {e}"))
+
+
+def _get_context():
+    # fork дешевле и не требует повторного импорта run.py в дочерних процессах
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
+def parse_file_parallel(log_file, workers, batch_size=1000, chunk_size=CHUNK_SIZE, start=0, end=None):
+    encoding = locale.getpreferredencoding(False)
+    tasks = [(log_file, chunk_start, chunk_stop, encoding)
+             for chunk_start, chunk_stop in split_file(log_file, chunk_size, start, end)]
+
+    with _get_context().Pool(workers) as pool:
+        # Ограничиваем число чанков в работе, чтобы не держать весь файл в памяти,
+        # и отдаём результаты в исходном порядке
+        pending = deque()
+        tasks = iter(tasks)
+        for task in tasks:
+            pending.append((task, pool.apply_async(parse_chunk, (task,))))
+            if len(pending) >= workers * 2:
+                break
+
+        while pending:
+            task, result = pending.popleft()
+            rows, lines = result.get()
+            LogParser.record_parse(task[2] - task[1], lines, len(rows))
+            next_task = next(tasks, None)
+            if next_task is not None:
+                pending.append((next_task, pool.apply_async(parse_chunk, (next_task,))))
+            for i in range(0, len(rows), batch_size):
+                yield rows[i:i + batch_size]
+
+
+def parse_files_parallel(ranges, workers, batch_size=1000, chunk_size=CHUNK_SIZE):
+    # ranges - (файл, start, end). Сжатый файл распаковывается одним процессом целиком, несжатый
+    # делится на куски; все задачи идут параллельно, пачки разных задач перемешиваются
+    tasks = []
+    for log_file, start, end in ranges:
+        if LogFiles.is_compressed(log_file):
+            tasks.append((log_file, start, None, batch_size))
+        else:
+            tasks.extend((log_file, chunk_start, chunk_stop, batch_size)
+                         for chunk_start, chunk_stop in split_file(log_file, chunk_size, start, end))
+    if not tasks:
+        return
+
+    context = _get_context()
+    # Очередь ограничена: разбор ждёт, пока запись не заберёт пачки, и память не растёт с размером логов
+    results = context.Queue(workers * 4)
+    with context.Pool(workers, _init_stream_worker, (results,)) as pool:
+        pool.map_async(stream_task, tasks, chunksize=1)
+        remaining = len(tasks)
+        while remaining:
+            kind, payload = results.get()
+            if kind == 'batch':
+                yield payload
+            elif kind == 'done':
+                remaining -= 1
+                for name, value in payload.items():
+                    Metrics.METRICS.inc(name, value)
+            else:
+                raise RuntimeError(f"Parsing failed: {payload}")
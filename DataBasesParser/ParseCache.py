@@ -0,0 +1,125 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from DataBasesParser import ColumnarEngine
+
+MAGIC = b'DBPCACHE'
+VERSION = 3
+ALIGNMENT = 64
+
+
+def content_hash(path, size, block_size=1024 * 1024):
+    # Хеш первых size байт лога (размер из ключа: дописанное во время импорта не учитывается)
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as file:
+        while size > 0 and (block := file.read(min(block_size, size))):
+            digest.update(block)
+            size -= len(block)
+    return digest.hexdigest()
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class ParseCache:
+    # Разобранные колонки лога в одном бинарном файле:
+    # MAGIC | длина заголовка | JSON-заголовок | выровненные массивы
+    def __init__(self, log_file, path=None):
+        self.log_file = log_file
+        self.path = path or f"{log_file}.parsecache"
+        self._key = None
+        self._hash = None
+
+    def _stat_key(self):
+        stat = os.stat(self.log_file)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'inode': stat.st_ino, 'device': stat.st_dev}
+
+    def _read_header(self, file):
+        prefix = file.read(len(MAGIC) + 8)
+        if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+            return None
+        (header_length,) = struct.unpack('<Q', prefix[len(MAGIC):])
+        header = json.loads(file.read(header_length))
+        return header if header.get('version') == VERSION else None
+
+    def load(self):
+        # Попадание: совпали размер, mtime и inode, либо (после touch/копирования) размер и хеш всего содержимого.
+        # Хеш краёв файла не годится: правка в середине лога без изменения размера его не меняет
+        try:
+            with open(self.path, 'rb') as file:
+                header = self._read_header(file)
+                if header is None:
+                    return None
+                key = self._stat_key()
+                cached = header['key']
+                if any(cached[name] != key[name] for name in ('size', 'mtime_ns', 'inode', 'device')):
+                    if cached['size'] != key['size'] or cached['hash'] != content_hash(self.log_file, key['size']):
+                        return None
+                buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, KeyError):
+            return None
+
+        def view(name):
+            dtype, offset, count = header['arrays'][name]
+            if count == 0:
+                return np.empty(0, dtype=dtype)
+            return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+        numbers = {name: view(name) for name in ColumnarEngine.NUMERIC_COLUMNS}
+        codes = {name: view(f"{name}.codes") for name in ColumnarEngine.STRING_COLUMNS}
+        dictionaries = {}
+        for name in ColumnarEngine.STRING_COLUMNS:
+            offsets = view(f"{name}.offsets").tolist()
+            blob = view(f"{name}.blob").tobytes()
+            dictionaries[name] = [blob[start:stop].decode('utf-8') for start, stop in zip(offsets, offsets[1:])]
+        return ColumnarEngine.ColumnarStore.from_arrays(numbers, codes, dictionaries, buffer)
+
+    def start_hashing(self):
+        # Ключ снимается до разбора, а хеш считается в потоке одновременно с ним: чтение и blake2b
+        # отпускают GIL, поэтому лог не перечитывается отдельно после импорта
+        self._key = self._stat_key()
+        executor = ThreadPoolExecutor(max_workers=1)
+        self._hash = executor.submit(content_hash, self.log_file, self._key['size'])
+        executor.shutdown(wait=False)
+
+    def save(self, store, end=None):
+        if self._hash is None:
+            self.start_hashing()
+        key = dict(self._key, hash=self._hash.result())
+
+        arrays = {}
+        for name in ColumnarEngine.NUMERIC_COLUMNS:
+            arrays[name] = store.column(name)
+        for name in ColumnarEngine.STRING_COLUMNS:
+            encoded = [value.encode('utf-8') for value in store.strings[name].values]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            arrays[f"{name}.codes"] = store.column(name)
+            arrays[f"{name}.offsets"] = offsets
+            arrays[f"{name}.blob"] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+        # Размер заголовка зависит от смещений, поэтому раскладку считаем с запасом под него
+        layout = {name: [array.dtype.str, 0, len(array)] for name, array in arrays.items()}
+        header = {'version': VERSION, 'key': key, 'rows': len(store), 'end': end, 'arrays': layout}
+        data_start = _align(len(MAGIC) + 8 + len(json.dumps(header)) + 32 * len(arrays))
+        offset = data_start
+        for name, array in arrays.items():
+            layout[name][1] = offset
+            offset = _align(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode('utf-8')
+        assert len(MAGIC) + 8 + len(header_bytes) <= data_start
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+            for name, array in arrays.items():
+                file.seek(layout[name][1])
+                file.write(memoryview(np.ascontiguousarray(array)).cast('B'))
+        os.replace(temp_path, self.path)
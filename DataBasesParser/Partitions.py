@@ -0,0 +1,244 @@
+import re
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Column, Index, Table, inspect, select, text, union_all
+
+# Посуточное секционирование таблицы import по timestamp: нативные RANGE-секции в PostgreSQL и MySQL,
+# отдельные таблицы-шарды import_pYYYYMMDD в SQLite. Удаление старых данных - DROP секции, а не DELETE
+PARTITION_PATTERN = re.compile(r'^import_p(\d{8})$')
+MYSQL_MAXVALUE = 'pmax'
+
+
+def partition_name(day):
+    return f"import_p{day:%Y%m%d}"
+
+
+def partition_day(name):
+    match = PARTITION_PATTERN.match(name)
+    return datetime.strptime(match.group(1), '%Y%m%d').date() if match else None
+
+
+def row_day(value):
+    # timestamp строки после BulkLoader: datetime или строка формата хранения SQLite
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value.date()
+
+
+class Partitioner:
+    def __init__(self, import_table):
+        self.import_table = import_table
+        # Дни существующих секций из каталога; перечитываются в начале каждого импорта и удаления
+        # и после ошибки (откат транзакции, секции другого процесса)
+        self.known = None
+
+    def _quoted(self, connection, name):
+        return connection.dialect.identifier_preparer.quote(name)
+
+    def _table(self, connection):
+        return connection.dialect.identifier_preparer.format_table(self.import_table)
+
+    def days(self, connection):
+        if self.known is None:
+            self.known = set(day for day in map(partition_day, self.partition_names(connection)) if day)
+        return self.known
+
+    def refresh(self):
+        self.known = None
+
+    @contextmanager
+    def refreshing_on_error(self):
+        # После отката созданные в транзакции секции пропадают, а удалённые возвращаются
+        try:
+            yield
+        except Exception:
+            self.refresh()
+            raise
+
+    def load(self, connection, loader, rows):
+        # Секции создаются до вставки пачки, строки по ним раскладывает сама СУБД
+        index = loader.column_names.index('timestamp')
+        with self.refreshing_on_error():
+            missing = {row_day(row[index]) for row in rows} - self.days(connection)
+            if missing:
+                self.known.update(self.create_partitions(connection, sorted(missing)))
+            loader.load(connection, rows)
+
+    def clear(self, connection):
+        self.refresh()
+        with self.refreshing_on_error():
+            self.drop(connection, sorted(self.days(connection)))
+
+    def drop_before(self, connection, cutoff):
+        # Секции, все строки которых старше cutoff (дата)
+        self.refresh()
+        with self.refreshing_on_error():
+            days = sorted(day for day in self.days(connection) if day < cutoff)
+            if days:
+                self.drop(connection, days)
+        return days
+
+    def drop(self, connection, days):
+        raise NotImplementedError
+
+    def partition_names(self, connection):
+        raise NotImplementedError
+
+    def create_partitions(self, connection, days):
+        # Возвращает дни, для которых появились секции
+        raise NotImplementedError
+
+
+class PostgresPartitioner(Partitioner):
+    TABLE_OPTIONS = {'postgresql_partition_by': 'RANGE (timestamp)'}
+
+    def partition_names(self, connection):
+        return connection.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "WHERE parent.relname = :table"), {'table': self.import_table.name}).scalars().all()
+
+    def create_partitions(self, connection, days):
+        for day in days:
+            connection.exec_driver_sql(
+                f"CREATE TABLE IF NOT EXISTS {self._quoted(connection, partition_name(day))} "
+                f"PARTITION OF {self._table(connection)} "
+                f"FOR VALUES FROM ('{day:%Y-%m-%d}') TO ('{day + timedelta(days=1):%Y-%m-%d}')")
+        return days
+
+    def drop(self, connection, days):
+        for day in days:
+            connection.exec_driver_sql(f"DROP TABLE IF EXISTS {self._quoted(connection, partition_name(day))}")
+            self.days(connection).discard(day)
+
+
+class MySQLPartitioner(Partitioner):
+    # Секция pYYYYMMDD хранит строки с TO_DAYS(timestamp) меньше следующего дня, поэтому первая
+    # секция принимает и более старые дни; pmax - хвост для ещё не созданных дней.
+    # ALTER TABLE в MySQL неявно фиксирует текущую транзакцию
+    def partition(self, connection):
+        connection.exec_driver_sql(f"ALTER TABLE {self._table(connection)} PARTITION BY RANGE "
+                                   f"(TO_DAYS({self._quoted(connection, 'timestamp')})) "
+                                   f"(PARTITION {MYSQL_MAXVALUE} VALUES LESS THAN MAXVALUE)")
+
+    def partition_names(self, connection):
+        return connection.execute(text(
+            "SELECT partition_name FROM information_schema.partitions "
+            "WHERE table_schema = DATABASE() AND table_name = :table AND partition_name IS NOT NULL"),
+            {'table': self.import_table.name}).scalars().all()
+
+    def create_partitions(self, connection, days):
+        # Новые секции отрезаются от pmax; день не позже последней секции уже покрыт ею
+        last = max(self.days(connection), default=None)
+        days = [day for day in days if last is None or day > last]
+        if not days:
+            return days
+        partitions = ', '.join(f"PARTITION {self._quoted(connection, partition_name(day))} "
+                               f"VALUES LESS THAN (TO_DAYS('{day + timedelta(days=1):%Y-%m-%d}'))" for day in days)
+        connection.exec_driver_sql(
+            f"ALTER TABLE {self._table(connection)} REORGANIZE PARTITION {MYSQL_MAXVALUE} INTO "
+            f"({partitions}, PARTITION {MYSQL_MAXVALUE} VALUES LESS THAN MAXVALUE)")
+        return days
+
+    def clear(self, connection):
+        super().clear(connection)
+        connection.exec_driver_sql(f"ALTER TABLE {self._table(connection)} TRUNCATE PARTITION {MYSQL_MAXVALUE}")
+
+    def drop(self, connection, days):
+        names = ', '.join(self._quoted(connection, partition_name(day)) for day in days)
+        connection.exec_driver_sql(f"ALTER TABLE {self._table(connection)} DROP PARTITION {names}")
+        self.days(connection).difference_update(days)
+
+
+class SQLitePartitioner(Partitioner):
+    # Шард - копия схемы import с AUTOINCREMENT; счётчик id шарда начинается с номера дня << 32,
+    # чтобы id оставались уникальными во всём UNION ALL шардов (отчёты соединяют строки по id)
+    ID_SHIFT = 32
+
+    def __init__(self, import_table):
+        super().__init__(import_table)
+        self.loaders = {}
+
+    def refresh(self):
+        super().refresh()
+        self.loaders = {}
+
+    def partition_names(self, connection):
+        return inspect(connection).get_table_names()
+
+    def shard(self, day):
+        return define_shard(self.import_table, day)
+
+    def create_partitions(self, connection, days):
+        for day in days:
+            shard = self.shard(day)
+            shard.create(connection, checkfirst=True)
+            connection.execute(text(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"),
+                {'name': shard.name, 'seq': day.toordinal() << self.ID_SHIFT})
+        return days
+
+    def load(self, connection, loader, rows):
+        # Пачка раскладывается по шардам своих дней, у каждого шарда свой загрузчик
+        index = loader.column_names.index('timestamp')
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row_day(row[index]), []).append(row)
+        with self.refreshing_on_error():
+            missing = by_day.keys() - self.days(connection)
+            if missing:
+                self.known.update(self.create_partitions(connection, sorted(missing)))
+            for day, day_rows in by_day.items():
+                shard_loader = self.loaders.get(day)
+                if shard_loader is None:
+                    shard_loader = self.loaders[day] = loader.for_table(self.shard(day), connection)
+                shard_loader.load(connection, day_rows)
+
+    def drop(self, connection, days):
+        for day in days:
+            self.shard(day).drop(connection, checkfirst=True)
+            self.days(connection).discard(day)
+            self.loaders.pop(day, None)
+
+
+def define_shard(import_table, day):
+    name = partition_name(day)
+    metadata = import_table.metadata
+    if name in metadata.tables:
+        return metadata.tables[name]
+    shard = Table(name, metadata, *(Column(column.name, column.type, primary_key=column.primary_key,
+                                           nullable=column.nullable) for column in import_table.columns),
+                  sqlite_autoincrement=True)
+    for index in import_table.indexes:
+        Index(index.name.replace('ix_import_', f"ix_{name}_"), *(shard.c[column.name] for column in index.columns))
+    return shard
+
+
+def shard_source(import_table, days, since=None):
+    # Строки import для запроса к SQLite: UNION ALL шардов, пересекающихся с окном [since, ...).
+    # Условие по timestamp внешнего запроса SQLite переносит внутрь каждой ветки и использует индексы шардов
+    if since is not None:
+        days = [day for day in days if day >= since.date()]
+    shards = [define_shard(import_table, day) for day in sorted(days)]
+    if not shards:
+        # Пустой шаблон import: окно не пересекается ни с одним днём
+        return import_table
+    if len(shards) == 1:
+        return shards[0]
+    return union_all(*(select(*shard.c) for shard in shards)).subquery('import')
+
+
+PARTITIONERS = {
+    'postgresql': PostgresPartitioner,
+    'mysql': MySQLPartitioner,
+    'sqlite': SQLitePartitioner,
+}
+
+
+def get_partitioner(db_type, import_table):
+    if db_type not in PARTITIONERS:
+        raise ValueError(f"Partitioning is not supported for {db_type}")
+    return PARTITIONERS[db_type](import_table)
@@ -0,0 +1,220 @@
+import itertools
+import json
+import time
+from collections import Counter
+
+from DataBasesParser import LogParser, Metrics, Rollup
+
+ROW_FIELDS = ('ip_address', 'forwarded_for', 'timestamp', 'request', 'status_code', 'response_size',
+              'time_taken', 'referer', 'user_agent', 'balancer_worker_name')
+
+
+class RedisStore:
+    # Раскладка в Redis:
+    #   import:next_id              - счётчик id строк
+    #   import:row:<id>             - hash с полями строки (timestamp - epoch в секундах)
+    #   import:ts                   - zset id по времени запроса
+    #   import:time_taken           - zset id по time_taken
+    #   import:count:client         - zset счётчиков по forwarded_for/referer/user_agent/balancer_worker_name
+    #   import:count:minute         - zset счётчиков по минутам, import:minute:first - первая строка минуты
+    #   import:count:worker, import:count:status - hash счётчиков
+    #   import:count:seg:<K>:<сегмент> - zset счётчиков клиентов по K-му сегменту пути (K до PATH_SEGMENTS)
+    #   import:segments             - отметка, что счётчики сегментов ведутся с первой строки
+    #   import:generation           - отметка последнего изменения данных (см. ResultCache)
+    PREFIX = 'import'
+
+    def __init__(self, client, chunk_size=1000):
+        self.r = client
+        self.chunk_size = chunk_size
+
+    def key(self, *parts):
+        return ':'.join((self.PREFIX,) + tuple(str(part) for part in parts))
+
+    def clear(self):
+        keys = [self.PREFIX]
+        for key in self.r.scan_iter(match=self.key('*'), count=self.chunk_size):
+            keys.append(key)
+            if len(keys) >= self.chunk_size:
+                self.r.delete(*keys)
+                keys = []
+        if keys:
+            self.r.delete(*keys)
+
+    def get_generation(self):
+        return self.r.get(self.key('generation'))
+
+    def set_generation(self, stamp):
+        self.r.set(self.key('generation'), stamp)
+
+    def write_batch(self, batch):
+        rows = []
+        errors = 0
+        sample = None
+        for data in batch:
+            try:
+                row = dict(zip(LogParser.FIELDS, data), timestamp=LogParser.parse_epoch(data[LogParser.TIMESTAMP]),
+                           status_code=int(data[LogParser.STATUS_CODE]),
+                           response_size=int(data[LogParser.RESPONSE_SIZE]),
+                           time_taken=int(data[LogParser.TIME_TAKEN]))
+            except ValueError as e:
+                errors += 1
+                sample = sample or e
+                continue
+            rows.append(row)
+        Metrics.conversion_errors(errors, sample)
+        if not rows:
+            return 0
+
+        # Один конвейер без MULTI на пачку: один сетевой round trip вместо одного на строку
+        first_id = self.r.incrby(self.key('next_id'), len(rows)) - len(rows) + 1
+        pipe = self.r.pipeline(transaction=False)
+        if first_id == 1:
+            pipe.set(self.key('segments'), 1)
+        for row_id, row in enumerate(rows, first_id):
+            minute = row['timestamp'] // 60 * 60
+            client = json.dumps([row[column] for column in Rollup.CLIENT_COLUMNS])
+            pipe.hset(self.key('row', row_id), mapping={field: row[field] for field in ROW_FIELDS})
+            pipe.zadd(self.key('ts'), {row_id: row['timestamp']})
+            pipe.zadd(self.key('time_taken'), {row_id: row['time_taken']})
+            pipe.zincrby(self.key('count', 'client'), 1, client)
+            for k, segment in enumerate(LogParser.request_parts(row['request'])[3:], 1):
+                pipe.zincrby(self.key('count', 'seg', k, segment), 1, client)
+            pipe.zincrby(self.key('count', 'minute'), 1, minute)
+            pipe.hsetnx(self.key('minute', 'first'), minute, row_id)
+            pipe.hincrby(self.key('count', 'worker'), row['balancer_worker_name'], 1)
+            pipe.hincrby(self.key('count', 'status'), row['status_code'], 1)
+        pipe.execute()
+        Metrics.METRICS.inc('db_round_trips', 2)
+        return len(rows)
+
+    def get_rows(self, row_ids, fields=ROW_FIELDS):
+        result = []
+        for start in range(0, len(row_ids), self.chunk_size):
+            pipe = self.r.pipeline(transaction=False)
+            for row_id in row_ids[start:start + self.chunk_size]:
+                pipe.hmget(self.key('row', row_id), fields)
+            result.extend(tuple(values) for values in pipe.execute())
+        return result
+
+    def iter_row_partitions(self, partition_size=None, fields=ROW_FIELDS):
+        partition_size = partition_size or self.chunk_size
+        last_id = int(self.r.get(self.key('next_id')) or 0)
+        for start in range(1, last_id + 1, partition_size):
+            rows = self.get_rows(range(start, min(start + partition_size, last_id + 1)), fields)
+            yield [dict(zip(fields, values)) for values in rows if values[0] is not None]
+
+    def window_id_chunks(self, seconds, chunk_size=None):
+        # id строк окна по времени, страницами ZRANGEBYSCORE ... LIMIT, а не одним списком
+        chunk_size = chunk_size or self.chunk_size
+        start = int(time.time()) - seconds
+        for offset in itertools.count(0, chunk_size):
+            row_ids = self.r.zrangebyscore(self.key('ts'), start, '+inf', start=offset, num=chunk_size)
+            if not row_ids:
+                return
+            yield row_ids
+
+    def _client_counts(self, limit=None, chunk_size=None, descending=True):
+        # Группы клиентов по числу запросов, страницами ZREVRANGE (ZRANGE) по chunk_size
+        chunk_size = chunk_size or self.chunk_size
+        read = self.r.zrevrange if descending else self.r.zrange
+        for start in itertools.count(0, chunk_size):
+            stop = start + chunk_size if limit is None else min(start + chunk_size, limit)
+            if stop <= start:
+                return
+            members = read(self.key('count', 'client'), start, stop - 1, withscores=True)
+            yield from ((tuple(json.loads(member)), int(score)) for member, score in members)
+            if len(members) < stop - start:
+                return
+
+    def _group_window(self, seconds, predicate=None):
+        # Счётчики групп держатся в памяти, строки окна читаются частями
+        fields = Rollup.CLIENT_COLUMNS + ('status_code',)
+        counts = Counter()
+        for row_ids in self.window_id_chunks(seconds):
+            for values in self.get_rows(row_ids, fields):
+                if values[0] is not None and (predicate is None or predicate(values)):
+                    counts[values[:4]] += 1
+        return counts.most_common()
+
+    @staticmethod
+    def _rows(rows, partition_size):
+        # partition_size задан в потоковом режиме: строки отдаются генератором, а Redis читается
+        # страницами по partition_size
+        return list(rows) if partition_size is None else rows
+
+    def get_ip_user_agent_statistics(self, n):
+        return [(forwarded_for, user_agent, referer, worker, count)
+                for (forwarded_for, referer, user_agent, worker), count in self._client_counts(n)]
+
+    def get_request_frequency(self, dT, partition_size=None):
+        return self._rows((group + (count,) for group, count in self._group_window(dT * 60)), partition_size)
+
+    def get_top_user_agents(self, N):
+        return [group + (count,) for group, count in self._client_counts(N)]
+
+    def get_50x_errors(self, S, dT, partition_size=None):
+        groups = self._group_window(dT * 60, lambda values: 500 <= int(values[4]) <= 599)
+        return self._rows((group for group, _ in groups), partition_size)
+
+    def get_longest_or_shortest_queries(self, N, longest=True):
+        key = self.key('time_taken')
+        row_ids = self.r.zrevrange(key, 0, N - 1) if longest else self.r.zrange(key, 0, N - 1)
+        return self.get_rows(row_ids, Rollup.CLIENT_COLUMNS)
+
+    def get_top_requests_to_kth_slash(self, N, K, segment='merlin-service-search'):
+        if 1 <= K <= LogParser.PATH_SEGMENTS and self.r.exists(self.key('segments')):
+            members = self.r.zrevrange(self.key('count', 'seg', K, segment), 0, N - 1)
+            return [tuple(json.loads(member)) for member in members]
+        # Дальние сегменты и данные, записанные без счётчиков сегментов: строки читаются конвейером частями
+        counts = Counter()
+        fields = Rollup.CLIENT_COLUMNS + ('request',)
+        for partition in self.iter_row_partitions(fields=fields):
+            for row in partition:
+                if LogParser.request_segment(row['request'], K) == segment:
+                    counts[tuple(row[column] for column in Rollup.CLIENT_COLUMNS)] += 1
+        return [group for group, _ in counts.most_common(N)]
+
+    def get_upstream_requests(self, partition_size=None):
+        return self._rows((group + (count,) for group, count in self._client_counts(chunk_size=partition_size)),
+                          partition_size)
+
+    def get_conversion_statistics(self, sort_by, partition_size=None):
+        if sort_by == 'transitions':
+            # Порядок по числу переходов даёт сам zset счётчиков
+            counts = self._client_counts(chunk_size=partition_size, descending=False)
+            return self._rows((group + (LogParser.referer_domain(group[1]), count) for group, count in counts),
+                              partition_size)
+        # Для сортировки по колонке клиента индекса нет: строки сортируются в памяти
+        result = [group + (LogParser.referer_domain(group[1]), count) for group, count in self._client_counts()]
+        sort_index = {'forwarded_for': 0, 'referer': 1, 'user_agent': 2, 'balancer_worker_name': 3,
+                      'domain': 4}.get(sort_by, 4)
+        return self._rows(iter(sorted(result, key=lambda row: row[sort_index])), partition_size)
+
+    def get_outgoing_requests(self, seconds, partition_size=None):
+        return self._rows((row for row_ids in self.window_id_chunks(seconds, partition_size)
+                           for row in self.get_rows(row_ids, Rollup.CLIENT_COLUMNS)), partition_size)
+
+    def get_largest_request_periods(self, N):
+        minutes = self.r.zrevrange(self.key('count', 'minute'), 0, N - 1)
+        row_ids = self.r.hmget(self.key('minute', 'first'), minutes) if minutes else []
+        return self.get_rows(row_ids, Rollup.CLIENT_COLUMNS)
+
+    def get_traffic_by_minute(self, dT=None, status_class=None, balancer_worker_name=None, path_prefix=None):
+        start = int(time.time()) // 60 * 60 - dT * 60 if dT is not None else '-inf'
+        row_ids = self.r.zrangebyscore(self.key('ts'), start, '+inf')
+        fields = ('timestamp', 'status_code', 'balancer_worker_name', 'request', 'time_taken')
+        minutes = {}
+        for timestamp, status_code, worker, request, time_taken in self.get_rows(row_ids, fields):
+            if timestamp is None:
+                continue
+            if status_class is not None and int(status_code) // 100 != status_class:
+                continue
+            if balancer_worker_name is not None and worker != balancer_worker_name:
+                continue
+            if path_prefix is not None and Rollup.path_prefix(request) != path_prefix:
+                continue
+            totals = minutes.setdefault(int(timestamp) // 60 * 60, [0, 0, 0])
+            totals[0] += 1
+            totals[1] += int(time_taken)
+            totals[2] = max(totals[2], int(time_taken))
+        return [(LogParser.epoch_to_datetime(minute), *totals) for minute, totals in sorted(minutes.items())]
@@ -0,0 +1,55 @@
+import logging
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from DataBasesParser import Metrics
+
+
+class ReportRunner:
+    # Отчёты выполняются параллельно в пуле потоков, а печатаются блоками в порядке запроса.
+    # Вывод каждого отчёта копится во временном файле, который держится в памяти до spool_size
+    def __init__(self, max_workers=1, spool_size=1024 * 1024, logger=None, inline=False):
+        self.max_workers = max(1, max_workers)
+        # inline: отчёты выполняются по очереди в вызывающем потоке (нужно для cProfile)
+        self.inline = inline
+        self.spool_size = spool_size
+        self.logger = logger or logging.getLogger(__name__)
+
+    def _execute(self, method_name, method, args, printer):
+        start_time = time.perf_counter()
+        output = tempfile.SpooledTemporaryFile(max_size=self.spool_size, mode='w+')
+        try:
+            printer(method(*args), output)
+        except BaseException:
+            output.close()
+            raise
+        execution_time = time.perf_counter() - start_time
+        Metrics.METRICS.observe(f"report_{method_name}", execution_time)
+        return output, execution_time
+
+    def run(self, reports, stream=None):
+        # reports: список (имя метода, метод, аргументы, функция печати)
+        stream = stream or sys.stdout
+        if self.inline:
+            for method_name, method, args, printer in reports:
+                self.logger.info(f"Executing {method_name} method...")
+                self._print(method_name, *self._execute(method_name, method, args, printer), stream)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            for method_name, method, args, printer in reports:
+                self.logger.info(f"Executing {method_name} method...")
+                futures.append((method_name, executor.submit(self._execute, method_name, method, args, printer)))
+
+            for method_name, future in futures:
+                self._print(method_name, *future.result(), stream)
+
+    def _print(self, method_name, output, execution_time, stream):
+        with output:
+            output.seek(0)
+            shutil.copyfileobj(output, stream)
+        stream.flush()
+        self.logger.info(f"{method_name} executed in {execution_time:.3f} seconds")
@@ -0,0 +1,182 @@
+import functools
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from DataBasesParser import Metrics
+
+# Отчёты, зависящие от текущего времени (окно "последние N минут"): их результат устаревает
+# без нового импорта, поэтому они не кешируются
+TIME_DEPENDENT = ('get_request_frequency', 'get_50x_errors', 'get_outgoing_requests', 'get_live_traffic')
+
+
+def is_time_dependent(method_name, args, kwargs):
+    if method_name == 'get_traffic_by_minute':
+        return (args[0] if args else kwargs.get('dT')) is not None
+    return method_name in TIME_DEPENDENT
+
+
+class ResultCache:
+    # LRU результатов отчётов в памяти с ограничением по числу записей и по размеру (байты pickle).
+    # path - необязательный каталог на диске, который переживает процесс (cron, несколько запусков run.py);
+    # файлы читаются через pickle, поэтому каталог должен быть доступен только своему пользователю
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, path=None, max_disk_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def get(self, key):
+        # (найдено, значение)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                Metrics.METRICS.inc('result_cache_hits')
+                return True, entry[0]
+        if self.path:
+            data = self._read_disk(key)
+            if data is not None:
+                value = pickle.loads(data)
+                self._remember(key, value, len(data))
+                with self._lock:
+                    self.disk_hits += 1
+                Metrics.METRICS.inc('result_cache_disk_hits')
+                return True, value
+        with self._lock:
+            self.misses += 1
+        Metrics.METRICS.inc('result_cache_misses')
+        return False, None
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, value, len(data))
+        if self.path:
+            self._write_disk(key, data)
+
+    def _remember(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+                Metrics.METRICS.inc('result_cache_evictions')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.disk_hits + self.misses
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'hits': self.hits,
+                    'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_ratio': round((self.hits + self.disk_hits) / requests, 4) if requests else 0.0}
+
+    def _file(self, key):
+        digest = hashlib.blake2b(pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL), digest_size=20).hexdigest()
+        return os.path.join(self.path, f"{digest}.result")
+
+    def _read_disk(self, key):
+        try:
+            with open(self._file(key), 'rb') as file:
+                stored_key, data = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        # Защита от коллизии имени файла
+        return data if stored_key == key else None
+
+    def _write_disk(self, key, data):
+        path = self._file(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as file:
+                pickle.dump((key, data), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except OSError:
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        # Самые давно записанные файлы удаляются, пока каталог больше max_disk_bytes
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.result'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class CachedAnalyzer:
+    # Обёртка над Analyzer: отчёты get_* берутся из кеша по ключу (база, отчёт, параметры, отметка импорта).
+    # Отметку меняет каждый импорт с новыми строками и удаление старых данных, поэтому кеш сбрасывается
+    # ровно тогда, когда меняются данные. Импорт в этом же процессе виден сразу, импорт другим
+    # процессом - после перечитывания отметки из базы, не реже чем раз в check_interval секунд
+    def __init__(self, analyzer, cache=None, check_interval=1.0):
+        self.analyzer = analyzer
+        self.cache = cache if cache is not None else ResultCache()
+        self.check_interval = check_interval
+        self._checked_at = None
+
+    def generation(self):
+        db_connection = self.analyzer.db_connection
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            return db_connection.import_generation()
+        return db_connection.generation
+
+    def key(self, method_name, args, kwargs):
+        analyzer = self.analyzer
+        return (analyzer.db_connection.identity(), self.generation(), analyzer.approximate,
+                tuple(analyzer.sketch_paths), method_name, args, tuple(sorted(kwargs.items())))
+
+    def __getattr__(self, name):
+        attribute = getattr(self.analyzer, name)
+        # Потоковый режим отдаёт генераторы строк: их нельзя держать в кеше
+        if not name.startswith('get_') or not callable(attribute) or self.analyzer.stream:
+            return attribute
+        return functools.partial(self.call, name, attribute)
+
+    def call(self, method_name, method, *args, **kwargs):
+        if is_time_dependent(method_name, args, kwargs):
+            return method(*args, **kwargs)
+        key = self.key(method_name, args, kwargs)
+        found, value = self.cache.get(key)
+        if found:
+            return value
+        value = method(*args, **kwargs)
+        if hasattr(value, '__next__'):
+            # Курсор или генератор читается один раз, в кеш попадает список строк
+            value = list(value)
+        self.cache.put(key, value)
+        return value
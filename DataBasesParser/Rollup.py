@@ -0,0 +1,164 @@
+import hashlib
+import json
+import operator
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, MetaData, String, Table, Text, func, inspect, select
+
+from DataBasesParser import LogParser, SqlFunctions
+
+CLIENT_COLUMNS = ('forwarded_for', 'referer', 'user_agent', 'balancer_worker_name')
+MINUTE_COLUMNS = ('minute', 'status_class', 'balancer_worker_name', 'path_prefix')
+# Группа клиента (значения CLIENT_COLUMNS) из кортежа разбора
+client_group = operator.itemgetter(*(LogParser.FIELD_INDEX[column] for column in CLIENT_COLUMNS))
+
+
+def group_key(values):
+    # Уникальный ключ группы: хеш значений, потому что уникальный индекс по длинным
+    # текстовым колонкам MySQL строит только по префиксу
+    return hashlib.blake2b(json.dumps(values, default=str).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def define_rollup_tables(metadata):
+    if 'import_rollup_minute' in metadata.tables:
+        return metadata.tables['import_rollup_minute'], metadata.tables['import_rollup_client']
+
+    # Поминутные счётчики: минута x класс статуса x воркер x первый сегмент пути
+    minute_table = Table('import_rollup_minute', metadata,
+                         Column('id', Integer, primary_key=True),
+                         Column('group_key', String(32), nullable=False),
+                         Column('minute', DateTime),
+                         Column('status_class', Integer),
+                         Column('balancer_worker_name', Text(length=100), nullable=True),
+                         Column('path_prefix', Text(length=255), nullable=True),
+                         Column('request_count', BigInteger),
+                         Column('time_taken_sum', BigInteger),
+                         Column('time_taken_max', BigInteger))
+    Index('ix_import_rollup_minute_minute', minute_table.c.minute)
+    Index('ux_import_rollup_minute_group', minute_table.c.group_key, unique=True)
+
+    # Счётчики по набору колонок, по которому группируют отчёты Analyzer
+    client_table = Table('import_rollup_client', metadata,
+                         Column('id', Integer, primary_key=True),
+                         Column('group_key', String(32), nullable=False),
+                         Column('forwarded_for', Text(length=3000), nullable=True),
+                         Column('referer', Text(length=3000), nullable=True),
+                         Column('user_agent', Text(length=3000), nullable=True),
+                         Column('balancer_worker_name', Text(length=100), nullable=True),
+                         Column('request_count', BigInteger))
+    Index('ix_import_rollup_client_group',
+          client_table.c.forwarded_for, client_table.c.referer,
+          client_table.c.user_agent, client_table.c.balancer_worker_name,
+          mysql_length={'forwarded_for': 64, 'referer': 255, 'user_agent': 255, 'balancer_worker_name': 64})
+    Index('ux_import_rollup_client_group', client_table.c.group_key, unique=True)
+    return minute_table, client_table
+
+
+def client_rows(groups):
+    # (значения CLIENT_COLUMNS, число запросов) -> строки import_rollup_client
+    return [dict(zip(CLIENT_COLUMNS, group), group_key=group_key(group), request_count=count)
+            for group, count in groups]
+
+
+def minute_rows(groups):
+    # (значения MINUTE_COLUMNS, (число, сумма и максимум time_taken)) -> строки import_rollup_minute
+    return [dict(zip(MINUTE_COLUMNS, group), group_key=group_key(group), request_count=count,
+                 time_taken_sum=total, time_taken_max=maximum)
+            for group, (count, total, maximum) in groups]
+
+
+def _upgrade(connection, table, columns):
+    # Таблица прежней раскладки хранила дельты без ключа группы: дельты сворачиваются
+    # по группе и переносятся в таблицу с уникальным ключом
+    legacy = Table(table.name, MetaData(), autoload_with=connection)
+    if 'group_key' in legacy.c:
+        return
+    group = [legacy.c[column] for column in columns]
+    totals = [(func.max if name == 'time_taken_max' else func.sum)(legacy.c[name]).label(name)
+              for name in ('request_count', 'time_taken_sum', 'time_taken_max') if name in legacy.c]
+    grouped = connection.execute(select(*group, *totals).group_by(*group)).mappings().fetchall()
+    legacy.drop(connection)
+    table.create(connection)
+    if grouped:
+        connection.execute(table.insert(), [dict(row, group_key=group_key(tuple(row[column] for column in columns)))
+                                            for row in grouped])
+
+
+def has_rollup_tables(connection):
+    inspector = inspect(connection)
+    return inspector.has_table('import_rollup_minute') and inspector.has_table('import_rollup_client')
+
+
+def apply_retention(connection, metadata, cutoff, source):
+    # Строки старше cutoff удалены: поминутные счётчики режутся по времени, а клиентские счётчики
+    # (без времени) пересчитываются по оставшимся строкам source
+    if not has_rollup_tables(connection):
+        return
+    minute_table, client_table = define_rollup_tables(metadata)
+    connection.execute(minute_table.delete().where(minute_table.c.minute < datetime.combine(cutoff, datetime.min.time())))
+    connection.execute(client_table.delete())
+    group = [source.c[column] for column in CLIENT_COLUMNS]
+    groups = connection.execute(select(*group, func.count()).group_by(*group)).fetchall()
+    if groups:
+        connection.execute(client_table.insert(), client_rows((tuple(row[:-1]), row[-1]) for row in groups))
+
+
+def path_prefix(request):
+    # "GET /api/v1/users HTTP/1.1" -> "/api"
+    parts = request.split(' ')
+    path = parts[1] if len(parts) > 1 else request
+    segment = path.split('?', 1)[0].split('/')
+    return '/' + segment[1] if len(segment) > 1 else path
+
+
+class RollupAccumulator:
+    # Частичные агрегаты копятся в памяти и прибавляются к строке своей группы (upsert по group_key),
+    # поэтому таблицы роллапов растут с числом групп, а не с числом сбросов и импортов
+    def __init__(self, metadata, max_groups=100000):
+        self.minute_table, self.client_table = define_rollup_tables(metadata)
+        self.max_groups = max_groups
+        self.minutes = defaultdict(lambda: [0, 0, 0])
+        self.clients = defaultdict(int)
+
+    def create(self, connection, clear=True):
+        inspector = inspect(connection)
+        for table, columns in ((self.minute_table, MINUTE_COLUMNS), (self.client_table, CLIENT_COLUMNS)):
+            if inspector.has_table(table.name):
+                _upgrade(connection, table, columns)
+            else:
+                table.create(connection)
+            if clear:
+                connection.execute(table.delete())
+
+    def add(self, batch):
+        # batch - кортежи разбора строк, которые действительно записаны в import
+        for data in batch:
+            try:
+                minute = LogParser.parse_timestamp(data[LogParser.TIMESTAMP]).replace(second=0)
+                time_taken = int(data[LogParser.TIME_TAKEN])
+                key = (minute, int(data[LogParser.STATUS_CODE]) // 100, data[LogParser.BALANCER_WORKER_NAME],
+                       path_prefix(data[LogParser.REQUEST]))
+            except ValueError:
+                continue
+            totals = self.minutes[key]
+            totals[0] += 1
+            totals[1] += time_taken
+            totals[2] = max(totals[2], time_taken)
+            self.clients[client_group(data)] += 1
+
+    def flush_if_full(self, connection):
+        if len(self.minutes) + len(self.clients) >= self.max_groups:
+            self.flush(connection)
+
+    def flush(self, connection):
+        if self.minutes:
+            connection.execute(SqlFunctions.upsert(connection, self.minute_table, 'group_key',
+                                                   summed=('request_count', 'time_taken_sum'),
+                                                   maximum=('time_taken_max',)),
+                               minute_rows(self.minutes.items()))
+            self.minutes.clear()
+        if self.clients:
+            connection.execute(SqlFunctions.upsert(connection, self.client_table, 'group_key', summed=('request_count',)),
+                               client_rows(self.clients.items()))
+            self.clients.clear()
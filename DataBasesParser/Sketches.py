@@ -0,0 +1,386 @@
+import base64
+import hashlib
+import json
+import math
+import os
+from array import array
+from collections import Counter
+
+from DataBasesParser import LogParser, Rollup
+
+# Приближённые сводки для логов, у которых точный GROUP BY не помещается в память.
+# Все сводки сливаются (merge), поэтому их можно копить по файлам и дням отдельно
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8', 'surrogateescape'), digest_size=8).digest(), 'little')
+
+
+def _key(group):
+    # Группа клиента как строка: ключ для хешей и для JSON
+    return json.dumps(group, ensure_ascii=False)
+
+
+def _encode_array(values):
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def _decode_array(typecode, data):
+    values = array(typecode)
+    values.frombytes(base64.b64decode(data))
+    return values
+
+
+class SpaceSaving:
+    # Top-K по Space-Saving с пакетным вытеснением: храним до 2*capacity счётчиков,
+    # при переполнении оставляем capacity самых больших. count - верхняя оценка,
+    # count - error - нижняя; у отсутствующей группы истинный счётчик не больше floor
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+        self.total = 0
+
+    def update(self, key, count=1):
+        self.total += count
+        if key in self.counts:
+            self.counts[key] += count
+            return
+        self.counts[key] = self.floor + count
+        self.errors[key] = self.floor
+        if len(self.counts) > 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        if len(self.counts) <= self.capacity:
+            return
+        ranked = sorted(self.counts, key=self.counts.__getitem__, reverse=True)
+        for key in ranked[self.capacity:]:
+            self.floor = max(self.floor, self.counts.pop(key))
+            del self.errors[key]
+
+    def merge(self, other):
+        # Группа, которой нет в одной из сводок, могла набрать там до её floor
+        for key in self.counts.keys() - other.counts.keys():
+            self.counts[key] += other.floor
+            self.errors[key] += other.floor
+        for key, count in other.counts.items():
+            if key in self.counts:
+                self.counts[key] += count
+                self.errors[key] += other.errors[key]
+            else:
+                self.counts[key] = count + self.floor
+                self.errors[key] = other.errors[key] + self.floor
+        self.floor += other.floor
+        self.total += other.total
+        self._prune()
+
+    def top(self, n=None):
+        ranked = sorted(self.counts.items(), key=lambda item: -item[1])
+        return [(key, count, self.errors[key]) for key, count in ranked[:n]]
+
+    def to_dict(self):
+        return {'capacity': self.capacity, 'floor': self.floor, 'total': self.total,
+                'items': [[key, count, self.errors[key]] for key, count in self.counts.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.floor = data['floor']
+        sketch.total = data['total']
+        for key, count, error in data['items']:
+            sketch.counts[key] = count
+            sketch.errors[key] = error
+        return sketch
+
+
+class CountMin:
+    # Оценка сверху, с вероятностью 1 - exp(-depth) завышение не больше e / width * total
+    def __init__(self, width=1 << 14, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = array('q', bytes(8 * width * depth))
+        self.total = 0
+
+    def _cells(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8', 'surrogateescape'), digest_size=4 * self.depth).digest()
+        for row in range(self.depth):
+            yield row * self.width + int.from_bytes(digest[4 * row:4 * row + 4], 'little') % self.width
+
+    def update(self, key, count=1):
+        self.total += count
+        for cell in self._cells(key):
+            self.table[cell] += count
+
+    def estimate(self, key):
+        return min(self.table[cell] for cell in self._cells(key))
+
+    def error_bound(self):
+        return math.e / self.width * self.total
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Count-Min sketches of different size cannot be merged")
+        for cell, count in enumerate(other.table):
+            if count:
+                self.table[cell] += count
+        self.total += other.total
+
+    def to_dict(self):
+        return {'width': self.width, 'depth': self.depth, 'total': self.total, 'table': _encode_array(self.table)}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['width'], data['depth'])
+        sketch.table = _decode_array('q', data['table'])
+        sketch.total = data['total']
+        return sketch
+
+
+class HyperLogLog:
+    # Число различных значений, стандартная ошибка 1.04 / sqrt(2 ** precision)
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value):
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Поправка для малых кардинальностей (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise ValueError("HyperLogLog sketches of different precision cannot be merged")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def to_dict(self):
+        return {'precision': self.precision, 'registers': base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['precision'])
+        sketch.registers = bytearray(base64.b64decode(data['registers']))
+        return sketch
+
+
+class TDigest:
+    # Квантили по t-digest (шкала k1): точнее всего на хвостах, ошибка по рангу
+    # в середине распределения порядка 1 / compression
+    def __init__(self, compression=100):
+        self.compression = compression
+        self.centroids = []
+        self.buffer = []
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, weight=1):
+        self.buffer.append((value, weight))
+        self.count += weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.buffer) >= 10 * self.compression:
+            self._compress()
+
+    def _scale(self, q):
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def _compress(self):
+        items = sorted(self.centroids + self.buffer)
+        self.buffer = []
+        if not items:
+            return
+        total = sum(weight for _, weight in items)
+        merged = []
+        mean, weight = items[0]
+        weight_before = 0
+        lower = self._scale(0)
+        for next_mean, next_weight in items[1:]:
+            if self._scale((weight_before + weight + next_weight) / total) - lower <= 1:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                merged.append((mean, weight))
+                weight_before += weight
+                lower = self._scale(weight_before / total)
+                mean, weight = next_mean, next_weight
+        merged.append((mean, weight))
+        self.centroids = merged
+
+    def quantile(self, q):
+        self._compress()
+        if not self.centroids:
+            return None
+        target = q * self.count
+        cumulative = 0
+        previous_mean, previous_center = self.min, 0
+        for mean, weight in self.centroids:
+            center = cumulative + weight / 2
+            if target < center:
+                if center == previous_center:
+                    return mean
+                return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+            previous_mean, previous_center = mean, center
+            cumulative += weight
+        if cumulative == previous_center:
+            return self.max
+        return previous_mean + (self.max - previous_mean) * (target - previous_center) / (cumulative - previous_center)
+
+    def merge(self, other):
+        other._compress()
+        self.buffer.extend(other.centroids)
+        self.count += other.count
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+        self._compress()
+
+    def to_dict(self):
+        self._compress()
+        return {'compression': self.compression, 'count': self.count, 'min': self.min, 'max': self.max,
+                'centroids': self.centroids}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['compression'])
+        sketch.centroids = [tuple(centroid) for centroid in data['centroids']]
+        sketch.count = data['count']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        return sketch
+
+
+class SketchSet:
+    # Набор сводок, который копится при импорте: top-K групп клиентов
+    # (forwarded_for/referer/user_agent/balancer_worker_name), уникальные IP и User-Agent, квантили time_taken
+    VERSION = 1
+
+    def __init__(self, capacity=10000):
+        self.clients = SpaceSaving(capacity)
+        self.client_counts = CountMin()
+        self.ip_addresses = HyperLogLog()
+        self.user_agents = HyperLogLog()
+        self.time_taken = TDigest()
+
+    def add_batch(self, batch):
+        # Пачка сначала сворачивается в Counter: сводки обновляются один раз на группу, а не на строку
+        clients = Counter()
+        ip_addresses = set()
+        user_agents = set()
+        for data in batch:
+            try:
+                time_taken = int(data[LogParser.TIME_TAKEN])
+            except (TypeError, ValueError):
+                continue
+            clients[_key(Rollup.client_group(data))] += 1
+            ip_addresses.add(data[LogParser.IP_ADDRESS])
+            user_agents.add(data[LogParser.USER_AGENT])
+            self.time_taken.add(time_taken)
+        for key, count in clients.items():
+            self.clients.update(key, count)
+            self.client_counts.update(key, count)
+        for value in ip_addresses:
+            if value is not None:
+                self.ip_addresses.add(value)
+        for value in user_agents:
+            if value is not None:
+                self.user_agents.add(value)
+
+    def observe(self, batches):
+        for batch in batches:
+            self.add_batch(batch)
+            yield batch
+
+    def merge(self, other):
+        self.clients.merge(other.clients)
+        self.client_counts.merge(other.client_counts)
+        self.ip_addresses.merge(other.ip_addresses)
+        self.user_agents.merge(other.user_agents)
+        self.time_taken.merge(other.time_taken)
+
+    def top_clients(self, n=None):
+        # Оценка группы - минимум из Space-Saving и Count-Min, обе оценки сверху
+        estimates = [(tuple(json.loads(key)), min(count, self.client_counts.estimate(key)))
+                     for key, count, _ in self.clients.top()]
+        return sorted(estimates, key=lambda item: -item[1])[:n]
+
+    def distinct_counts(self):
+        return [('ip_address', self.ip_addresses.estimate(), self.ip_addresses.relative_error()),
+                ('user_agent', self.user_agents.estimate(), self.user_agents.relative_error())]
+
+    def quantiles(self, qs=(0.5, 0.9, 0.99, 0.999)):
+        return [(q, self.time_taken.quantile(q)) for q in qs]
+
+    def error_bounds(self):
+        return {'rows': self.clients.total,
+                'top_k_missing_group_max_count': self.clients.floor,
+                'count_min_overestimate': round(self.client_counts.error_bound(), 1),
+                'count_min_confidence': round(1 - math.exp(-self.client_counts.depth), 4),
+                'distinct_relative_error': round(self.ip_addresses.relative_error(), 4),
+                'quantile_rank_error': round(1 / self.time_taken.compression, 4)}
+
+    def to_dict(self):
+        return {'version': self.VERSION, 'clients': self.clients.to_dict(),
+                'client_counts': self.client_counts.to_dict(), 'ip_addresses': self.ip_addresses.to_dict(),
+                'user_agents': self.user_agents.to_dict(), 'time_taken': self.time_taken.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported sketch version: {data.get('version')}")
+        sketches = cls()
+        sketches.clients = SpaceSaving.from_dict(data['clients'])
+        sketches.client_counts = CountMin.from_dict(data['client_counts'])
+        sketches.ip_addresses = HyperLogLog.from_dict(data['ip_addresses'])
+        sketches.user_agents = HyperLogLog.from_dict(data['user_agents'])
+        sketches.time_taken = TDigest.from_dict(data['time_taken'])
+        return sketches
+
+    def save(self, path):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.to_dict(), file)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'r') as file:
+                return cls.from_dict(json.load(file))
+        except OSError:
+            return None
+
+    @classmethod
+    def load_merged(cls, paths):
+        merged = None
+        for path in paths:
+            sketches = cls.load(path)
+            if sketches is None:
+                continue
+            if merged is None:
+                merged = sketches
+            else:
+                merged.merge(sketches)
+        return merged
+
+
+def sketch_path(log_file):
+    return f"{log_file}.sketches"
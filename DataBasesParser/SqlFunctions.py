@@ -0,0 +1,131 @@
+from sqlalchemy import String, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import GenericFunction
+
+
+# Функции, которые в каждом диалекте пишутся по-своему.
+# Для SQLite аналогов нет, поэтому они регистрируются как Python-функции соединения
+
+
+def split_part_value(value, delimiter, index):
+    # То же, что SUBSTRING_INDEX(SUBSTRING_INDEX(value, delimiter, index+1), delimiter, -1)
+    if value is None:
+        return None
+    parts = value.split(delimiter)
+    return parts[index] if index < len(parts) else parts[-1]
+
+
+class split_part(GenericFunction):
+    # split_part(value, delimiter, index): index-й (с нуля) фрагмент строки
+    type = String()
+    inherit_cache = True
+
+
+class greatest(GenericFunction):
+    # greatest(a, b): большее из значений
+    inherit_cache = True
+
+
+class minute_bucket(GenericFunction):
+    # Начало минуты временной метки в виде строки 'YYYY-MM-DD HH:MM'
+    type = String()
+    inherit_cache = True
+
+
+@compiles(split_part)
+def _split_part_default(element, compiler, **kw):
+    value, delimiter, index = element.clauses
+    return "SUBSTRING_INDEX(SUBSTRING_INDEX(%s, %s, %s + 1), %s, -1)" % (
+        compiler.process(value, **kw), compiler.process(delimiter, **kw),
+        compiler.process(index, **kw), compiler.process(delimiter, **kw))
+
+
+@compiles(split_part, 'postgresql')
+def _split_part_postgresql(element, compiler, **kw):
+    value, delimiter, index = element.clauses
+    value, delimiter, index = (compiler.process(clause, **kw) for clause in (value, delimiter, index))
+    # В отличие от MySQL SPLIT_PART возвращает '' за последним фрагментом, поэтому берём последний явно
+    parts = f"string_to_array({value}, {delimiter})"
+    return f"({parts})[LEAST(CAST({index} AS INTEGER) + 1, array_length({parts}, 1))]"
+
+
+@compiles(split_part, 'sqlite')
+def _split_part_sqlite(element, compiler, **kw):
+    return "split_part(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(greatest, 'sqlite')
+def _greatest_sqlite(element, compiler, **kw):
+    # В SQLite max с несколькими аргументами - скалярная функция
+    return "max(%s)" % compiler.process(element.clauses, **kw)
+
+
+def _percent(compiler):
+    # При paramstyle format/pyformat литеральный % нужно удваивать
+    return '%%' if compiler.dialect.paramstyle in ('format', 'pyformat') else '%'
+
+
+@compiles(minute_bucket)
+def _minute_bucket_default(element, compiler, **kw):
+    pattern = '{0}Y-{0}m-{0}d {0}H:{0}i'.format(_percent(compiler))
+    return f"DATE_FORMAT({compiler.process(element.clauses, **kw)}, '{pattern}')"
+
+
+@compiles(minute_bucket, 'postgresql')
+def _minute_bucket_postgresql(element, compiler, **kw):
+    return f"to_char({compiler.process(element.clauses, **kw)}, 'YYYY-MM-DD HH24:MI')"
+
+
+@compiles(minute_bucket, 'sqlite')
+def _minute_bucket_sqlite(element, compiler, **kw):
+    pattern = '{0}Y-{0}m-{0}d {0}H:{0}M'.format(_percent(compiler))
+    return f"strftime('{pattern}', {compiler.process(element.clauses, **kw)})"
+
+
+def register_sqlite_functions(engine):
+    @event.listens_for(engine, 'connect')
+    def _register(dbapi_connection, connection_record):
+        dbapi_connection.create_function('split_part', 3, split_part_value, deterministic=True)
+
+
+
+def _dialect_insert(connection):
+    # insert() диалекта с ON CONFLICT / ON DUPLICATE KEY; None - диалект их не поддерживает
+    dialect = connection.dialect.name
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def upsert(connection, table, key, summed=(), maximum=()):
+    # INSERT, который для уже существующего ключа key (уникальный индекс) прибавляет summed
+    # и берёт большее из maximum. Без поддержки в диалекте - обычный INSERT
+    insert = _dialect_insert(connection)
+    if insert is None:
+        return table.insert()
+    statement = insert(table)
+    new = statement.inserted if connection.dialect.name == 'mysql' else statement.excluded
+    values = {name: table.c[name] + new[name] for name in summed}
+    values.update({name: greatest(table.c[name], new[name]) for name in maximum})
+    if connection.dialect.name == 'mysql':
+        return statement.on_duplicate_key_update(values)
+    return statement.on_conflict_do_update(index_elements=[key], set_=values)
+
+
+
+def insert_ignore(connection, table, key):
+    # INSERT, пропускающий строки с уже существующим ключом key (уникальный индекс)
+    insert = _dialect_insert(connection)
+    if insert is None:
+        return table.insert()
+    statement = insert(table)
+    if connection.dialect.name == 'mysql':
+        # Присваивание ключа самому себе: в отличие от INSERT IGNORE другие ошибки не подавляются
+        return statement.on_duplicate_key_update({key: statement.inserted[key]})
+    return statement.on_conflict_do_nothing(index_elements=[key])
@@ -1,2 +1,22 @@
+from DataBasesParser import Metrics
+from DataBasesParser import Config
 from DataBasesParser import Connector
-from DataBasesParser import DataAnalyzer
\ No newline at end of file
+from DataBasesParser import DataAnalyzer
+from DataBasesParser import LogParser
+from DataBasesParser import BulkLoader
+from DataBasesParser import Checkpoint
+from DataBasesParser import Dimensions
+from DataBasesParser import LiveWindow
+from DataBasesParser import LogFiles
+from DataBasesParser import ParallelImport
+from DataBasesParser import Partitions
+from DataBasesParser import ResultCache
+from DataBasesParser import Rollup
+from DataBasesParser import RedisStore
+from DataBasesParser import MongoStore
+from DataBasesParser import SqlFunctions
+from DataBasesParser import LatencyHistogram
+from DataBasesParser import FusedScan
+from DataBasesParser import LogGenerator
+from DataBasesParser import Sketches
+from DataBasesParser import ReportRunner
@@ -0,0 +1,219 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from DataBasesParser import LogGenerator
+
+# Определение логгера
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(formatter)
+logger.addHandler(stream_handler)
+
+BACKENDS = ('sqlite', 'columnar', 'postgresql', 'mysql', 'redis', 'mongodb')
+
+# Отчёты бенчмарка: (метод Analyzer, аргументы)
+REPORTS = [
+    ('get_ip_user_agent_statistics', (5,)),
+    ('get_request_frequency', (2,)),
+    ('get_top_user_agents', (10,)),
+    ('get_50x_errors', ('500', 30)),
+    ('get_longest_or_shortest_queries', (10, True)),
+    ('get_top_requests_to_kth_slash', (5, 2)),
+    ('get_upstream_requests', ()),
+    ('get_conversion_statistics', ('domain',)),
+    ('get_outgoing_requests', (300,)),
+    ('get_largest_request_periods', (5,)),
+]
+
+
+def run_backend(db_type, db_name, log_file, workers, queue):
+    # Каждый бэкенд меряется в отдельном процессе, чтобы пиковый RSS не смешивался
+    from DataBasesParser import Connector, DataAnalyzer
+    result = {}
+    try:
+        db_connection = Connector.DatabaseConnection(db_type, db_name)
+        db_connection.connect()
+        start_time = time.perf_counter()
+        row_count = db_connection.import_log_data(log_file, workers=workers)
+        seconds = time.perf_counter() - start_time
+        result['import'] = {'rows': row_count, 'seconds': round(seconds, 4),
+                            'rows_per_sec': round(row_count / max(seconds, 1e-9), 1)}
+
+        analyzer = DataAnalyzer.Analyzer(db_connection, db_type)
+        reports = {}
+        for method_name, args in REPORTS:
+            start_time = time.perf_counter()
+            rows = len(list(getattr(analyzer, method_name)(*args)))
+            reports[method_name] = {'seconds': round(time.perf_counter() - start_time, 4), 'rows': rows}
+        result['reports'] = reports
+        db_connection.close()
+    except Exception as e:
+        # Бэкенд недоступен локально (нет сервера или драйвера) - пропускаем
+        result = {'skipped': f"{type(e).__name__}: {e}"}
+    # ru_maxrss в Linux - килобайты
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(result)
+
+
+def measure(db_type, db_name, log_file, workers, timeout):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=run_backend, args=(db_type, db_name, log_file, workers, queue))
+    process.start()
+    try:
+        return queue.get(timeout=timeout)
+    except Exception:
+        process.terminate()
+        return {'skipped': f"timed out after {timeout} seconds"}
+    finally:
+        process.join()
+
+
+def parse_per_field(log_file, import_table):
+    # Прежний путь разбора: regex с именованными группами, groupdict и поиск типа колонки на каждое поле
+    from sqlalchemy import Integer
+    from DataBasesParser import LogParser
+    rows = 0
+    with open(log_file, 'r') as file:
+        for line in file:
+            match = LogParser.LOG_PATTERN.match(line)
+            if match:
+                values = {}
+                for column, value in match.groupdict().items():
+                    if column in import_table.columns:
+                        column_obj = import_table.columns[column]
+                        if isinstance(column_obj.type, Integer):
+                            value = int(value)
+                        values[column_obj] = value
+                rows += 1
+    return rows
+
+
+def benchmark_parsers(log_file, repeat=3):
+    # Разбор и преобразование строк к типам колонок без записи в СУБД; лучшее время из repeat запусков
+    from sqlalchemy import MetaData
+    from DataBasesParser import BulkLoader, Connector, LogParser
+    db_connection = Connector.DatabaseConnection('sqlite', 'benchmark')
+    db_connection.metadata = MetaData()
+    import_table = db_connection.define_import_table()
+    loader = BulkLoader.BulkLoader(import_table)
+    paths = {
+        'per_field': lambda: parse_per_field(log_file, import_table),
+        'regex': lambda: sum(len(loader.to_rows(batch)) for batch in LogParser.parse_file(log_file)),
+    }
+    results = {}
+    for name, run in paths.items():
+        timings = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            rows = run()
+            timings.append(time.perf_counter() - start_time)
+        seconds = min(timings)
+        results[name] = {'rows': rows, 'seconds': round(seconds, 4),
+                         'rows_per_sec': round(rows / max(seconds, 1e-9), 1)}
+    results['speedup_vs_per_field'] = round(results['per_field']['seconds'] / max(results['regex']['seconds'], 1e-9), 2)
+    return results
+
+
+def compare(report, baseline_path, threshold):
+    # Регрессия: время импорта или отчёта выросло больше чем на threshold процентов
+    with open(baseline_path, 'r') as file:
+        baseline = json.load(file)
+    regressions = []
+    for db_type, result in report['results'].items():
+        previous = baseline.get('results', {}).get(db_type, {})
+        timings = [('import', result.get('import', {}).get('seconds'), previous.get('import', {}).get('seconds'))]
+        timings += [(name, timing['seconds'], previous.get('reports', {}).get(name, {}).get('seconds'))
+                    for name, timing in result.get('reports', {}).items()]
+        for name, seconds, previous_seconds in timings:
+            # Разница меньше 10 мс - шум таймера, а не регрессия
+            if (seconds is not None and previous_seconds and seconds - previous_seconds > 0.01
+                    and seconds > previous_seconds * (1 + threshold / 100)):
+                regressions.append({'backend': db_type, 'stage': name,
+                                    'seconds': seconds, 'baseline_seconds': previous_seconds})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the log import and reports on every local backend')
+    parser.add_argument('--rows', type=int, default=100000, help='Number of generated log lines')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the log generator')
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of the value distributions')
+    parser.add_argument('--ips', type=int, default=1000, help='Number of distinct client IPs')
+    parser.add_argument('--user_agents', type=int, default=200, help='Number of distinct User-Agents')
+    parser.add_argument('--referers', type=int, default=500, help='Number of distinct referers')
+    parser.add_argument('--paths', type=int, default=2000, help='Number of distinct request paths')
+    parser.add_argument('--end', type=int,
+                        help='Unix time of the newest generated line (default: now); fix it for byte-identical logs')
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS),
+                        help='Backends to measure; unavailable ones are reported as skipped. '
+                             'The import clears the existing import data of each backend')
+    parser.add_argument('--db_name', default='benchmark', help='Database name used for the server backends')
+    parser.add_argument('--workers', type=int, default=1, help='Number of parser processes for the import')
+    parser.add_argument('--workdir', help='Directory for the generated log and the SQLite file')
+    parser.add_argument('--timeout', type=float, default=3600, help='Time limit per backend in seconds')
+    parser.add_argument('--parsers', action='store_true',
+                        help='Also time the parser against the old per-field path (parse and type conversion only, no database)')
+    parser.add_argument('--output', default='benchmark.json', help='Path of the JSON report')
+    parser.add_argument('--baseline', help='Previous JSON report to check for regressions')
+    parser.add_argument('--threshold', type=float, default=20.0, help='Allowed slowdown against the baseline, %%')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix='dbparser-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    params = {'rows': args.rows, 'seed': args.seed, 'skew': args.skew, 'ips': args.ips,
+              'user_agents': args.user_agents, 'referers': args.referers, 'paths': args.paths,
+              'workers': args.workers, 'end': args.end}
+    log_file = os.path.join(workdir, 'access_log')
+    start_time = time.perf_counter()
+    LogGenerator.LogGenerator(seed=args.seed, skew=args.skew, ips=args.ips, user_agents=args.user_agents,
+                              referers=args.referers, paths=args.paths, end=args.end).write(log_file, args.rows)
+    logger.info(f"Generated {args.rows} lines in {time.perf_counter() - start_time:.2f} seconds ({log_file})")
+
+    parsers = None
+    if args.parsers:
+        parsers = benchmark_parsers(log_file)
+        logger.info(f"Parser: {parsers['regex']['rows_per_sec']:.0f} rows/sec, "
+                    f"{parsers['speedup_vs_per_field']}x per-field regex")
+
+    results = {}
+    for db_type in args.backends:
+        logger.info(f"Benchmarking {db_type}...")
+        results[db_type] = measure(db_type, args.db_name, log_file, args.workers, args.timeout)
+        if 'skipped' in results[db_type]:
+            logger.info(f"{db_type} skipped: {results[db_type]['skipped']}")
+        else:
+            logger.info(f"{db_type}: {results[db_type]['import']['rows_per_sec']:.0f} rows/sec, "
+                        f"peak RSS {results[db_type]['peak_rss_kb'] / 1024:.1f} MB")
+
+    report = {'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'log_size_bytes': os.path.getsize(log_file), 'params': params, 'results': results}
+    if parsers:
+        report['parsers'] = parsers
+    if baseline:
+        report['regressions'] = compare(report, baseline, args.threshold)
+        for regression in report['regressions']:
+            logger.warning(f"Regression: {regression['backend']} {regression['stage']} "
+                           f"{regression['baseline_seconds']:.3f}s -> {regression['seconds']:.3f}s")
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"Report written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import MetaData, create_engine, func, select
+
+from DataBasesParser import Dimensions
+
+
+class RacingEncoder(Dimensions.DimensionEncoder):
+    # Первый поиск не видит строку, которую к моменту вставки уже записал другой импорт
+    def _lookup(self, connection, column, values, locking=False):
+        if not locking:
+            return {}
+        return super()._lookup(connection, column, values, locking)
+
+
+class DimensionEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory, 'data.db')}")
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_concurrent_importers_share_ids(self):
+        first = Dimensions.DimensionEncoder(MetaData())
+        with self.engine.connect() as connection:
+            first.create(connection)
+            ids = first.encode(connection, 'user_agent', ['agent/1', 'agent/2'])
+            connection.commit()
+
+        second = RacingEncoder(MetaData())
+        with self.engine.connect() as connection:
+            second.create(connection, clear=False)
+            self.assertEqual(second.encode(connection, 'user_agent', ['agent/2', 'agent/1', 'agent/3'])[:2],
+                             ids[::-1])
+            connection.commit()
+            table = second.tables['user_agent']
+            self.assertEqual(connection.execute(select(func.count()).select_from(table)).scalar(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
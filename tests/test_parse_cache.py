@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from DataBasesParser import Connector, LogGenerator, ParseCache
+
+END = 1700000000
+
+
+class ParseCacheTest(unittest.TestCase):
+    # Кеш разбора принимается только для того же содержимого лога
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = LogGenerator.LogGenerator(seed=11, span=60, end=END).write(
+            os.path.join(self.directory, 'access_log'), 2000)
+        self.connection = Connector.DatabaseConnection('columnar', 'cache')
+        self.connection.connect()
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def import_rows(self, log_file=None):
+        return self.connection.import_log_data(log_file or self.log, parse_cache=True)
+
+    def status_count(self, status):
+        return int((self.connection.store.column('status_code') == status).sum())
+
+    def test_hit_on_unchanged_file(self):
+        self.assertEqual(self.import_rows(), 2000)
+        self.assertIsNotNone(ParseCache.ParseCache(self.log).load())
+        self.assertEqual(self.import_rows(), 2000)
+
+    def test_hit_after_touch(self):
+        self.import_rows()
+        stat = os.stat(self.log)
+        os.utime(self.log, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNotNone(ParseCache.ParseCache(self.log).load())
+
+    def test_miss_after_same_size_edit(self):
+        self.import_rows()
+        self.assertEqual(self.status_count(599), 0)
+        with open(self.log, 'r+b') as file:
+            data = file.read()
+            position = data.index(b'" 200 ', len(data) // 2)
+            file.seek(position)
+            file.write(b'" 599 ')
+        stat = os.stat(self.log)
+        # Отметка времени гарантированно другая, даже при грубом разрешении mtime файловой системы
+        os.utime(self.log, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertEqual(os.path.getsize(self.log), stat.st_size)
+        self.assertIsNone(ParseCache.ParseCache(self.log).load())
+        self.assertEqual(self.import_rows(), 2000)
+        self.assertEqual(self.status_count(599), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
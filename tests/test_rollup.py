@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import text
+
+from DataBasesParser import Config, Connector, LogGenerator
+
+END = 1700000000
+
+
+class RollupTest(unittest.TestCase):
+    # Роллапы после нескольких инкрементальных импортов: одна строка на группу и те же суммы, что в import
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = os.path.join(self.directory, 'access_log')
+        self.generator = LogGenerator.LogGenerator(seed=5, span=600, end=END, ips=20, user_agents=5, referers=5)
+        self.connection = Connector.DatabaseConnection(
+            'sqlite', 'rollup', settings={**Config.connection_settings('sqlite'),
+                                          'url': f"sqlite:///{os.path.join(self.directory, 'data.db')}"})
+        self.connection.connect()
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def append(self, rows):
+        with open(self.log, 'a') as file:
+            file.writelines(self.generator.lines(rows))
+
+    def query(self, sql):
+        with self.connection.engine.connect() as connection:
+            return tuple(connection.execute(text(sql)).one())
+
+    def test_incremental_imports_upsert_groups(self):
+        self.append(1000)
+        # Строка проходит регулярное выражение, но её timestamp не преобразуется
+        with open(self.log, 'a') as file:
+            file.write('10.0.0.1 (192.168.0.1) - - [14/Foo/2023:22:09:56 +0000] "GET /api/x HTTP/1.1" '
+                       '200 10 10 1 "-" "agent"\n')
+        self.assertEqual(self.connection.import_log_data(self.log), 1000)
+        for _ in range(3):
+            self.append(300)
+            self.connection.import_log_data(self.log, incremental=True)
+
+        rows, time_taken = self.query("SELECT COUNT(*), SUM(time_taken) FROM import")
+        self.assertEqual(rows, 1900)
+        (groups,) = self.query("SELECT COUNT(*) FROM (SELECT DISTINCT forwarded_for, referer, user_agent, "
+                               "balancer_worker_name FROM import)")
+        self.assertEqual(self.query("SELECT SUM(request_count), COUNT(*) FROM import_rollup_client"), (rows, groups))
+        self.assertEqual(self.query("SELECT SUM(request_count), SUM(time_taken_sum) FROM import_rollup_minute"),
+                         (rows, time_taken))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import text
+
+from DataBasesParser import Config, Connector, LogGenerator
+
+END = 1700000000
+
+
+class RotationTest(unittest.TestCase):
+    # Инкрементальный импорт набора access_log* между ротациями logrotate: каждая строка
+    # должна попасть в import ровно один раз
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log = os.path.join(self.directory, 'access_log')
+        self.pattern = f"{self.log}*"
+        self.generator = LogGenerator.LogGenerator(seed=7, span=60, end=END)
+        self.connection = Connector.DatabaseConnection(
+            'sqlite', 'rotation', settings={**Config.connection_settings('sqlite'),
+                                            'url': f"sqlite:///{os.path.join(self.directory, 'data.db')}"})
+        self.connection.connect()
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def append(self, path, rows):
+        with open(path, 'a') as file:
+            file.writelines(self.generator.lines(rows))
+
+    def compress(self, source, target):
+        with open(source, 'rb') as file, gzip.open(target, 'wb') as compressed:
+            shutil.copyfileobj(file, compressed)
+        os.remove(source)
+
+    def import_rows(self):
+        return self.connection.import_log_data(self.pattern, incremental=True)
+
+    def count(self):
+        with self.connection.engine.connect() as connection:
+            return connection.execute(text("SELECT COUNT(*) FROM import")).scalar()
+
+    def test_rename_and_compress(self):
+        self.append(self.log, 2000)
+        self.assertEqual(self.import_rows(), 2000)
+        self.append(self.log, 500)
+        # create + compress: прежний живой лог сжимается под новым inode, дописанные строки - в нём
+        self.compress(self.log, f"{self.log}.1.gz")
+        self.append(self.log, 500)
+        self.assertEqual(self.import_rows(), 1000)
+        self.assertEqual(self.count(), 3000)
+        self.assertEqual(self.import_rows(), 0)
+        self.assertEqual(self.count(), 3000)
+
+    def test_delaycompress(self):
+        self.append(self.log, 1000)
+        self.import_rows()
+        self.append(self.log, 200)
+        os.rename(self.log, f"{self.log}.1")
+        self.append(self.log, 300)
+        self.assertEqual(self.import_rows(), 500)
+        # Следующая ротация сжимает access_log.1 в access_log.2.gz
+        self.append(self.log, 100)
+        self.compress(f"{self.log}.1", f"{self.log}.2.gz")
+        os.rename(self.log, f"{self.log}.1")
+        self.append(self.log, 50)
+        self.assertEqual(self.import_rows(), 150)
+        self.assertEqual(self.count(), 1650)
+
+    def test_copytruncate(self):
+        self.append(self.log, 1000)
+        self.import_rows()
+        self.append(self.log, 100)
+        # copytruncate: копия получает новый inode, живой лог обрезается на месте
+        shutil.copyfile(self.log, f"{self.log}.1")
+        open(self.log, 'w').close()
+        self.append(self.log, 200)
+        self.assertEqual(self.import_rows(), 300)
+        self.assertEqual(self.count(), 1300)
+
+
+if __name__ == '__main__':
+    unittest.main()